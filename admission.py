@@ -0,0 +1,213 @@
+from google.api_core import exceptions
+from tracing import span
+from typing import List, Optional, Tuple
+import contextlib
+import heapq
+import itertools
+import random
+import threading
+import time
+import uuid
+
+
+class LocalSemaphore:
+
+    def __init__(self, limit: int) -> None:
+        """Concurrency cap of this instance only, stand-in for `FirestoreSemaphore`
+
+        Args:
+            limit (int): maximum number of slots held at once
+        """
+        self._limit = limit
+        self._held = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> Optional[object]:
+        """Take a slot if one is free
+
+        Returns:
+            Optional[object]: slot to release, None if all slots are held
+        """
+        with self._lock:
+            if self._held >= self._limit:
+                return None
+            self._held += 1
+            return self._held
+
+    def release(self, slot: object) -> None:
+        """Release a slot taken by `try_acquire`
+
+        Args:
+            slot (object): slot
+        """
+        with self._lock:
+            self._held -= 1
+
+
+class FirestoreSemaphore:
+
+    def __init__(self, db, collection: str = 'order_admission', limit: int = 4, lease: float = 60) -> None:
+        """Concurrency cap shared by all instances, with one document per held slot
+
+        A slot is taken by creating document `slot_<n>` and released by deleting it. A slot
+        not released within its lease (eg: holder crashed) is reclaimed by next caller.
+
+        Args:
+            db (firestore.Client): firestore client
+            collection (str, optional): collection of slot documents. Defaults to 'order_admission'.
+            limit (int, optional): maximum number of slots held at once. Defaults to 4.
+            lease (float, optional): seconds after which a held slot is reclaimed. Defaults to 60.
+        """
+        self._db = db
+        self._collection = collection
+        self._slots = ['slot_%s' % i for i in range(limit)]
+        self._lease = lease
+        self._holder = uuid.uuid4().hex
+
+    def try_acquire(self) -> Optional[Tuple[object, object]]:
+        """Take a slot if one is free or expired
+
+        Returns:
+            Optional[Tuple[object, object]]: slot to release, None if all slots are held
+        """
+        col_ref = self._db.collection(self._collection)
+        with span('firestore.admission_acquire'):
+            held = {snapshot.id: snapshot for snapshot in col_ref.stream()}
+            now = time.time()
+
+            # Instances start from different free slots, so they rarely collide
+            free = [slot for slot in self._slots if slot not in held]
+            random.shuffle(free)
+            for slot in free:
+                lease = self._create(col_ref.document(slot), now)
+                if lease is not None:
+                    return lease
+
+            for slot in self._slots:
+                snapshot = held.get(slot)
+                if snapshot is None or snapshot.to_dict().get('expires_at', 0) >= now:
+                    continue
+                try:
+                    # Precondition makes sure only one caller reclaims an expired slot
+                    snapshot.reference.delete(option=self._db.write_option(last_update_time=snapshot.update_time))
+                except (exceptions.FailedPrecondition, exceptions.NotFound):
+                    continue
+                print("reclaimed expired admission slot '%s' of holder %s" % (slot, snapshot.to_dict().get('holder')))
+                lease = self._create(snapshot.reference, now)
+                if lease is not None:
+                    return lease
+        return None
+
+    def release(self, slot: Tuple[object, object]) -> None:
+        """Release a slot taken by `try_acquire`
+
+        Args:
+            slot (Tuple[object, object]): slot
+        """
+        doc_ref, update_time = slot
+        with span('firestore.admission_release'):
+            try:
+                doc_ref.delete(option=self._db.write_option(last_update_time=update_time))
+            except (exceptions.FailedPrecondition, exceptions.NotFound):
+                # Lease expired and slot was reclaimed by another holder
+                pass
+
+    def _create(self, doc_ref, now: float) -> Optional[Tuple[object, object]]:
+        try:
+            result = doc_ref.create({u'holder': self._holder, u'expires_at': now + self._lease})
+        except exceptions.AlreadyExists:
+            return None
+        return doc_ref, result.update_time
+
+
+class AdmissionController:
+
+    def __init__(self, semaphore, poll_interval: float = 0.25) -> None:
+        """Admit requests through a semaphore, so that bursts wait for a slot instead of
+        all hitting exchange at once. Requests waiting in this instance are admitted
+        highest priority first, then in arrival order.
+
+        Args:
+            semaphore (LocalSemaphore|FirestoreSemaphore): semaphore capping concurrency
+            poll_interval (float, optional): seconds between attempts to take a slot
+                while all slots are held. Defaults to 0.25.
+        """
+        self._semaphore = semaphore
+        self._poll_interval = poll_interval
+        self._waiting: List[Tuple[float, int]] = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def waiting(self) -> int:
+        """Number of requests of this instance waiting for a slot"""
+        with self._condition:
+            return len(self._waiting)
+
+    def acquire(self, priority: float, timeout: float) -> Optional[object]:
+        """Wait for a slot
+
+        Args:
+            priority (float): priority of request (eg: order size)
+            timeout (float): seconds to wait for a slot
+
+        Returns:
+            Optional[object]: slot to release, None if no slot was free in time
+        """
+        entry = (-priority, next(self._sequence))
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+
+        try:
+            while True:
+                # Only the first waiting request tries to take a slot
+                with self._condition:
+                    while self._waiting[0] != entry:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return None
+                        self._condition.wait(remaining)
+
+                slot = self._semaphore.try_acquire()
+                if slot is not None:
+                    return slot
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                with self._condition:
+                    self._condition.wait(min(remaining, self._poll_interval * random.uniform(0.5, 1.5)))
+        finally:
+            with self._condition:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def release(self, slot: object) -> None:
+        """Release a slot taken by `acquire`
+
+        Args:
+            slot (object): slot
+        """
+        self._semaphore.release(slot)
+        with self._condition:
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def admit(self, priority: float, timeout: float):
+        """Hold a slot within the block
+
+        Args:
+            priority (float): priority of request (eg: order size)
+            timeout (float): seconds to wait for a slot
+
+        Yields:
+            bool: True if request was admitted, False if no slot was free in time
+        """
+        slot = self.acquire(priority, timeout)
+        try:
+            yield slot is not None
+        finally:
+            if slot is not None:
+                self.release(slot)
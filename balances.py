@@ -0,0 +1,68 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, TextIO
+import csv
+import json
+
+# Supported export formats of balance records
+EXPORT_FORMATS = ('text', 'csv', 'jsonl')
+
+
+@dataclass
+class BalanceRecord:
+    """Positive balances of a user in `balances` or `pending_balances`"""
+    collection: str
+    uid: str
+    balances: Dict[str, float]
+
+
+def parse_thresholds(value: str) -> Dict[str, float]:
+    """Parse per-currency thresholds
+
+    Args:
+        value (str): thresholds separated by '|' (eg: BTC:0.001|USDS:1)
+
+    Returns:
+        Dict[str, float]: minimum balance by currency
+    """
+    thresholds = {}
+    for item in (value or '').split('|'):
+        if not item.strip():
+            continue
+        currency, threshold = item.split(':')
+        thresholds[currency.strip()] = float(threshold)
+    return thresholds
+
+
+def write_balance_records(records: Iterable[BalanceRecord], fp: TextIO, fmt: str = 'text') -> int:
+    """Write balance records one by one, so memory use doesn't grow with number of users
+
+    Args:
+        records (Iterable[BalanceRecord]): balance records
+        fp (TextIO): output stream
+        fmt (str, optional): 'text', 'csv' (one line per user and currency) or 'jsonl'. Defaults to 'text'.
+
+    Returns:
+        int: number of records written
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError('unsupported export format: {}'.format(fmt))
+
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(fp)
+        writer.writerow(['collection', 'uid', 'currency', 'balance'])
+
+    count = 0
+    for record in records:
+        if fmt == 'csv':
+            for currency, balance in record.balances.items():
+                writer.writerow([record.collection, record.uid, currency, balance])
+        elif fmt == 'jsonl':
+            fp.write(json.dumps({'collection': record.collection, 'uid': record.uid, 'balances': record.balances}) + '\n')
+        else:
+            msg = '[{}] User: {}'.format(record.collection, record.uid)
+            for currency, balance in record.balances.items():
+                msg += ' {}:{}'.format(currency, balance)
+            fp.write(msg + '\n')
+        count += 1
+    return count
@@ -0,0 +1,203 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import collections
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+# Month code used in bybit future symbol names (eg: BTCUSDZ21)
+_MONTH_CODES = {3: 'H', 6: 'M', 9: 'U', 12: 'Z'}
+
+
+class ExchangeSimulator:
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        jitter: float = 0.005,
+        error_rate: float = 0.0,
+        order_rate_limit: float = None,
+        price: float = 50000.0,
+        host: str = '127.0.0.1',
+        port: int = 0) -> None:
+        """Stand-in http server for the bybit and ftx endpoints used by this repository
+
+        Args:
+            latency (float, optional): mean seconds taken by each request. Defaults to 0.02.
+            jitter (float, optional): standard deviation of latency in seconds. Defaults to 0.005.
+            error_rate (float, optional): ratio of requests answered with http 503. Defaults to 0.
+            order_rate_limit (float, optional): bybit orders accepted per second, orders beyond it
+                are rejected with rate limit ret_code 10006. Defaults to no limit.
+            price (float, optional): price returned for every market. Defaults to 50000.
+            host (str, optional): address to listen on. Defaults to '127.0.0.1'.
+            port (int, optional): port to listen on, 0 picks a free one. Defaults to 0.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.order_rate_limit = order_rate_limit
+        self.price = price
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._order_times = collections.deque()
+        self._order_ids = itertools.count(1)
+        self._orders_by_link_id = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self) -> 'ExchangeSimulator':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'ExchangeSimulator':
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def symbols(self) -> List[dict]:
+        """Bybit inverse futures of current and next quarter, for BTC and ETH
+        """
+        now = datetime.datetime.utcnow()
+        symbols = []
+        for base_currency in ('BTC', 'ETH'):
+            symbols.append(self._symbol(base_currency, base_currency + 'USD', base_currency + 'USD', None))
+            for months_ahead in (0, 3):
+                month = ((now.month - 1) // 3) * 3 + 3 + months_ahead
+                year = now.year + (month - 1) // 12
+                month = (month - 1) % 12 + 1
+                expiry = datetime.date(year, month, 25)
+                name = '%sUSD%s%s' % (base_currency, _MONTH_CODES[month], expiry.strftime('%y'))
+                alias = '%sUSD%s' % (base_currency, expiry.strftime('%m%d'))
+                symbols.append(self._symbol(base_currency, name, alias, expiry))
+        return symbols
+
+    @staticmethod
+    def _symbol(base_currency: str, name: str, alias: str, expiry: datetime.date) -> dict:
+        return {
+            'name': name,
+            'alias': alias,
+            'status': 'Trading',
+            'base_currency': base_currency,
+            'quote_currency': 'USD',
+            'delivery_time': expiry.strftime('%Y-%m-%dT08:00:00Z') if expiry else None
+        }
+
+    def _respond(self, method: str, path: str, body: dict):
+        with self._lock:
+            self.requests += 1
+
+        delay = max(random.gauss(self.latency, self.jitter), 0)
+        time.sleep(delay)
+
+        if random.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return 503, {'error': 'simulated outage'}
+
+        created_at = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+        # Bybit
+        if method == 'GET' and path.startswith('/v2/public/symbols'):
+            return 200, {'ret_code': 0, 'ret_msg': 'OK', 'result': self.symbols()}
+        if method == 'POST' and path.startswith('/v2/private/order/create'):
+            if not self._accept_order():
+                return 200, {'ret_code': 10006, 'ret_msg': 'too many visits', 'result': None}
+            order = {
+                'order_id': 'sim-%s' % next(self._order_ids),
+                'order_link_id': body.get('order_link_id', ''),
+                'symbol': body['symbol'],
+                'side': body['side'],
+                'qty': body['qty'],
+                'order_type': body.get('order_type', 'Market'),
+                'order_status': 'Created',
+                'created_at': created_at
+            }
+            if order['order_link_id']:
+                with self._lock:
+                    if order['order_link_id'] in self._orders_by_link_id:
+                        return 200, {'ret_code': 30073, 'ret_msg': 'order_link_id is repeated', 'result': None}
+                    self._orders_by_link_id[order['order_link_id']] = order
+            return 200, {'ret_code': 0, 'ret_msg': 'OK', 'result': order}
+        if method == 'GET' and path.startswith('/v2/private/order?'):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+            with self._lock:
+                order = self._orders_by_link_id.get(query.get('order_link_id', [''])[0])
+            if order is None or order['symbol'] != query.get('symbol', [''])[0]:
+                return 200, {'ret_code': 20001, 'ret_msg': 'order not exists', 'result': None}
+            return 200, {'ret_code': 0, 'ret_msg': 'OK', 'result': order}
+
+        # FTX
+        if method == 'GET' and path.startswith('/api/markets/'):
+            return 200, {'success': True, 'result': {'name': path[len('/api/markets/'):], 'price': self.price}}
+        if method == 'POST' and path.startswith('/api/orders'):
+            return 200, {'success': True, 'result': {
+                'id': next(self._order_ids),
+                'market': body['market'],
+                'side': body['side'],
+                'size': body['size'],
+                'type': body.get('type', 'market'),
+                'createdAt': created_at
+            }}
+
+        return 404, {'error': 'unknown endpoint %s %s' % (method, path)}
+
+    def _accept_order(self) -> bool:
+        if self.order_rate_limit is None:
+            return True
+
+        # Sliding window of last second
+        now = time.monotonic()
+        with self._lock:
+            while self._order_times and self._order_times[0] <= now - 1:
+                self._order_times.popleft()
+            if len(self._order_times) >= self.order_rate_limit:
+                self.throttled += 1
+                return False
+            self._order_times.append(now)
+            return True
+
+    def _handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections alive, like the real exchanges
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._handle({})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self._handle(json.loads(self.rfile.read(length) or b'{}'))
+
+            def _handle(self, body: dict):
+                status, payload = simulator._respond(self.command, self.path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,376 @@
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+import copy
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+class FakeFirestore:
+
+    def __init__(self, latency: float = 0.0) -> None:
+        """In-memory stand-in for `firestore.Client`, covering the api used by `DbRecords`
+
+        Args:
+            latency (float, optional): seconds added to every round trip. Defaults to 0.
+        """
+        self.latency = latency
+        self.round_trips = 0
+        self._documents: Dict[str, dict] = {}
+        self._update_times: Dict[str, float] = {}
+        self._last_update_time = 0.0
+        self._lock = threading.RLock()
+
+    def collection(self, path: str) -> 'CollectionReference':
+        return CollectionReference(self, path)
+
+    def collection_group(self, group_id: str) -> 'Query':
+        return Query(self, group_id=group_id)
+
+    def document(self, path: str) -> 'DocumentReference':
+        return DocumentReference(self, path)
+
+    def batch(self) -> 'WriteBatch':
+        return WriteBatch(self)
+
+    def write_option(self, last_update_time: float = None) -> 'WriteOption':
+        return WriteOption(last_update_time)
+
+    def seed(self, path: str, data: dict) -> None:
+        """Write a document without counting a round trip, to prepare a benchmark
+
+        Args:
+            path (str): path of document
+            data (dict): fields of document
+        """
+        DocumentReference(self, path)._set(data)
+
+    def get_all(self, refs: list, field_paths: list = None) -> list:
+        self._round_trip()
+        snapshots = [ref._snapshot() for ref in refs]
+        if field_paths is not None:
+            for snapshot in snapshots:
+                if snapshot.exists:
+                    snapshot._data = {key: value for key, value in snapshot._data.items() if key in field_paths}
+        return snapshots
+
+    def _round_trip(self) -> None:
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class WriteOption:
+
+    def __init__(self, last_update_time: float = None) -> None:
+        self.last_update_time = last_update_time
+
+
+class WriteResult:
+
+    def __init__(self, update_time: float) -> None:
+        self.update_time = update_time
+
+
+class DocumentSnapshot:
+
+    def __init__(self, reference: 'DocumentReference', data: dict, update_time: float = None) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return copy.deepcopy(self._data)
+
+    def get(self, field: str):
+        return self._data[field]
+
+
+class DocumentReference:
+
+    def __init__(self, db: FakeFirestore, path: str) -> None:
+        self._db = db
+        self.path = path
+        self.id = path.split('/')[-1]
+
+    @property
+    def parent(self) -> 'CollectionReference':
+        return CollectionReference(self._db, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name: str) -> 'CollectionReference':
+        return CollectionReference(self._db, self.path + '/' + name)
+
+    def collections(self) -> list:
+        self._db._round_trip()
+        prefix = self.path + '/'
+        with self._db._lock:
+            names = {path[len(prefix):].split('/')[0] for path in self._db._documents if path.startswith(prefix)}
+        return [self.collection(name) for name in sorted(names)]
+
+    def get(self) -> DocumentSnapshot:
+        self._db._round_trip()
+        return self._snapshot()
+
+    def set(self, data: dict, merge: bool = False) -> None:
+        self._db._round_trip()
+        self._set(data, merge)
+
+    def create(self, data: dict) -> WriteResult:
+        self._db._round_trip()
+        self._create(data)
+        return WriteResult(self._db._update_times[self.path])
+
+    def update(self, data: dict, option: WriteOption = None) -> None:
+        self._db._round_trip()
+        self._update(data, option)
+
+    def delete(self, option: WriteOption = None) -> None:
+        self._db._round_trip()
+        self._delete(option)
+
+    def _snapshot(self) -> DocumentSnapshot:
+        with self._db._lock:
+            return DocumentSnapshot(
+                self, copy.deepcopy(self._db._documents.get(self.path)), self._db._update_times.get(self.path))
+
+    def _set(self, data: dict, merge: bool = False) -> None:
+        with self._db._lock:
+            if merge and self.path in self._db._documents:
+                _merge(self._db._documents[self.path], copy.deepcopy(data))
+            else:
+                self._db._documents[self.path] = copy.deepcopy(data)
+            self._touch()
+
+    def _create(self, data: dict) -> None:
+        with self._db._lock:
+            if self.path in self._db._documents:
+                raise AlreadyExists(self.path)
+            self._db._documents[self.path] = copy.deepcopy(data)
+            self._touch()
+
+    def _update(self, data: dict, option: WriteOption = None) -> None:
+        with self._db._lock:
+            if self.path not in self._db._documents:
+                raise NotFound(self.path)
+            if option is not None and option.last_update_time != self._db._update_times.get(self.path):
+                raise FailedPrecondition(self.path)
+            self._db._documents[self.path].update(copy.deepcopy(data))
+            self._touch()
+
+    def _delete(self, option: WriteOption = None) -> None:
+        with self._db._lock:
+            if option is not None and option.last_update_time != self._db._update_times.get(self.path):
+                raise FailedPrecondition(self.path)
+            self._db._documents.pop(self.path, None)
+            self._db._update_times.pop(self.path, None)
+
+    def _touch(self) -> None:
+        # Strictly increasing, so every write gets its own update time
+        self._db._last_update_time = max(time.time(), self._db._last_update_time + 1e-6)
+        self._db._update_times[self.path] = self._db._last_update_time
+
+
+class Query:
+
+    def __init__(self, db: FakeFirestore, parent: str = None, group_id: str = None) -> None:
+        self._db = db
+        self._parent = parent
+        self._group_id = group_id
+        self._filters: List[tuple] = []
+        self._orders: List[tuple] = []
+        self._limit = None
+        self._fields = None
+        self._start_after = None
+        self._range = None
+
+    def where(self, field: str, op: str, value) -> 'Query':
+        query = self._copy()
+        query._filters.append((field, op, value))
+        return query
+
+    def order_by(self, field: str, direction: str = 'ASCENDING') -> 'Query':
+        query = self._copy()
+        query._orders.append((field, direction))
+        return query
+
+    def limit(self, count: int) -> 'Query':
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def select(self, fields: list) -> 'Query':
+        query = self._copy()
+        query._fields = list(fields)
+        return query
+
+    def start_after(self, snapshot: DocumentSnapshot) -> 'Query':
+        # Like firestore, cursor is the position of the snapshot in query order, so it
+        # still works after the snapshot's document is deleted
+        query = self._copy()
+        query._start_after = snapshot
+        return query
+
+    def get_partitions(self, partition_count: int) -> list:
+        # Like firestore, partitions are ranges of document names of roughly equal size
+        self._db._round_trip()
+        with self._db._lock:
+            paths = sorted(path for path, data in self._db._documents.items() if self._matches(path, data))
+        size = max(-(-len(paths) // partition_count), 1)
+        bounds = [None] + paths[size::size] + [None]
+        return [QueryPartition(self, start, end) for start, end in zip(bounds, bounds[1:])]
+
+    def stream(self):
+        self._db._round_trip()
+        with self._db._lock:
+            rows = [(path, copy.deepcopy(data)) for path, data in self._db._documents.items() if self._matches(path, data)]
+            update_times = {path: self._db._update_times.get(path) for path, _ in rows}
+
+        # Documents are finally ordered by name, in direction of last order
+        orders = list(self._orders)
+        if not orders or orders[-1][0] != '__name__':
+            orders.append(('__name__', orders[-1][1] if orders else 'ASCENDING'))
+
+        for field, _ in orders:
+            if field != '__name__':
+                rows = [row for row in rows if field in row[1]]
+        for field, direction in reversed(orders):
+            rows.sort(key=lambda row: _value(row[0], row[1], field), reverse=direction == 'DESCENDING')
+
+        if self._start_after is not None:
+            cursor_path = self._start_after.reference.path
+            cursor_data = self._start_after.to_dict() or {}
+            cursor = [_value(cursor_path, cursor_data, field) for field, _ in orders]
+            rows = [row for row in rows if _after(
+                [_value(row[0], row[1], field) for field, _ in orders], cursor, orders)]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+
+        if self._range is not None:
+            start, end = self._range
+            rows = [row for row in rows if (start is None or row[0] >= start) and (end is None or row[0] < end)]
+
+        for path, data in rows:
+            if self._fields is not None:
+                data = {key: value for key, value in data.items() if key in self._fields}
+            yield DocumentSnapshot(DocumentReference(self._db, path), data, update_times[path])
+
+    def _matches(self, path: str, data: dict) -> bool:
+        parent, _ = path.rsplit('/', 1) if '/' in path else ('', path)
+        if self._group_id is not None:
+            if parent.split('/')[-1] != self._group_id:
+                return False
+        elif parent != self._parent:
+            return False
+        return all(field in data and _OPERATORS[op](data[field], value) for field, op, value in self._filters)
+
+    def _copy(self) -> 'Query':
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        return query
+
+
+class QueryPartition:
+
+    def __init__(self, parent: Query, start_at: str, end_at: str) -> None:
+        self._parent = parent
+        self.start_at = start_at
+        self.end_at = end_at
+
+    def query(self) -> Query:
+        query = self._parent._copy()
+        query._range = (self.start_at, self.end_at)
+        return query
+
+
+def _merge(target: dict, data: dict) -> None:
+    # Like firestore, nested maps are merged field by field
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def _value(path: str, data: dict, field: str):
+    return path if field == '__name__' else data[field]
+
+
+def _after(values: list, cursor: list, orders: list) -> bool:
+    for value, cursor_value, (_, direction) in zip(values, cursor, orders):
+        if value != cursor_value:
+            return value < cursor_value if direction == 'DESCENDING' else value > cursor_value
+    return False
+
+
+class CollectionReference(Query):
+
+    def __init__(self, db: FakeFirestore, path: str) -> None:
+        super().__init__(db, parent=path)
+        self.path = path
+        self.id = path.split('/')[-1]
+
+    @property
+    def parent(self) -> DocumentReference:
+        return DocumentReference(self._db, self.path.rsplit('/', 1)[0]) if '/' in self.path else None
+
+    def document(self, document_id: str = None) -> DocumentReference:
+        return DocumentReference(self._db, self.path + '/' + (document_id or uuid.uuid4().hex[:20]))
+
+    def add(self, data: dict) -> tuple:
+        doc_ref = self.document()
+        doc_ref.set(data)
+        return time.time(), doc_ref
+
+
+class WriteBatch:
+
+    def __init__(self, db: FakeFirestore) -> None:
+        self._db = db
+        self._writes = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def set(self, doc_ref: DocumentReference, data: dict, merge: bool = False) -> None:
+        self._writes.append(lambda: doc_ref._set(data, merge))
+
+    def create(self, doc_ref: DocumentReference, data: dict) -> None:
+        self._writes.append(lambda: doc_ref._create(data))
+
+    def update(self, doc_ref: DocumentReference, data: dict) -> None:
+        self._writes.append(lambda: doc_ref._update(data))
+
+    def delete(self, doc_ref: DocumentReference) -> None:
+        self._writes.append(doc_ref._delete)
+
+    def commit(self) -> None:
+        if len(self._writes) > 500:
+            raise ValueError('a batch can contain at most 500 writes')
+        self._db._round_trip()
+        with self._db._lock:
+            # Batch is atomic, so restore all documents if a write fails
+            documents = dict(self._db._documents)
+            update_times = dict(self._db._update_times)
+            try:
+                for write in self._writes:
+                    write()
+            except Exception:
+                self._db._documents.clear()
+                self._db._documents.update(documents)
+                self._db._update_times.clear()
+                self._db._update_times.update(update_times)
+                raise
@@ -0,0 +1,41 @@
+from typing import Dict
+
+# Secrets read by main, with values suitable for the exchange simulator
+DEFAULT_SECRETS = {
+    'BYBIT_IS_TESTNET': 'True',
+    'BYBIT_API_KEY': 'benchmark',
+    'BYBIT_API_SECRET': 'benchmark',
+    'FTX_API_KEY': 'benchmark',
+    'FTX_API_SECRET': 'benchmark',
+    'FTX_SUB_ACCOUNT': 'benchmark',
+}
+
+
+class _Payload:
+
+    def __init__(self, value: str) -> None:
+        self.data = value.encode('UTF-8')
+
+
+class _Response:
+
+    def __init__(self, value: str) -> None:
+        self.payload = _Payload(value)
+
+
+class FakeSecretClient:
+
+    def __init__(self, secrets: Dict[str, str] = None) -> None:
+        """In-memory stand-in for `SecretManagerServiceClient`
+
+        Args:
+            secrets (Dict[str, str], optional): secret values by name. Defaults to DEFAULT_SECRETS.
+        """
+        self._secrets = dict(DEFAULT_SECRETS if secrets is None else secrets)
+        self.requests = 0
+
+    def access_secret_version(self, request: dict) -> _Response:
+        # name is projects/{project_id}/secrets/{secret_name}/versions/latest
+        self.requests += 1
+        secret_name = request['name'].split('/')[3]
+        return _Response(self._secrets[secret_name])
@@ -0,0 +1,264 @@
+"""Offline latency benchmark of the cloud function entry points.
+
+Exchanges are served by `ExchangeSimulator`, firestore by `FakeFirestore` (or the
+firestore emulator if FIRESTORE_EMULATOR_HOST is set) and secrets by `FakeSecretClient`.
+
+Usage (from repository root):
+    python -m benchmark.run --scenario place_order --concurrency 8 --requests 200 --output bench.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import time
+
+from benchmark.exchange_simulator import ExchangeSimulator
+from benchmark.fake_firestore import FakeFirestore
+from benchmark.fake_secrets import FakeSecretClient
+from benchmark import sim_clients
+
+SCENARIOS = ('place_order', 'update_market_price', 'purge_old_market_price')
+
+
+class _Context:
+
+    def __init__(self, resource: str = None) -> None:
+        self.resource = resource
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values
+
+    Args:
+        values (List[float]): values
+        pct (float): percentile between 0 and 100
+
+    Returns:
+        float: percentile
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def load_main(simulator: ExchangeSimulator, db) -> object:
+    """Import main with firestore, secrets and exchange clients replaced by local stand-ins
+    """
+    os.environ.setdefault('GCP_PROJECT', 'benchmark')
+    os.environ.setdefault('TARGET_MARKETS', 'BTC-PERP|ETH-PERP')
+
+    # ftx_client is only needed for its FtxClient, which is replaced anyway
+    try:
+        importlib.import_module('ftx_client')
+    except ImportError:
+        sys.modules['ftx_client'] = sim_clients
+
+    import db_records
+    import secret_manager
+    import main
+
+    if 'FIRESTORE_EMULATOR_HOST' not in os.environ:
+        db_records.set_firestore_client(db)
+    secret_manager.set_secret_client(FakeSecretClient())
+    main._clients['bybit'] = sim_clients.SimBybitClient(simulator.url)
+    main._clients['ftx'] = sim_clients.FtxClient(simulator.url)
+    return main
+
+
+def _place_order_request(main, db, index: int) -> Callable[[], bool]:
+    conversions = [
+        ('BTC', 'USDS', 0.01, 50000.0),
+        ('USDS', 'ETH', 100.0, 1.0),
+        ('USDT', 'USDS', 100.0, 1.0),
+        ('USDS', 'USDC', 100.0, 1.0),
+    ]
+    from_currency, to_currency, amount, rate = conversions[index % len(conversions)]
+    path = 'convert_history/user%s/history/%s' % (index, from_currency)
+    fields = {
+        'from_currency': from_currency,
+        'to_currency': to_currency,
+        'amount': amount,
+        'rate': rate,
+        'status': 'pending'
+    }
+    db.seed(path, fields)
+    event = {'value': {'fields': {key: {'stringValue': str(value)} for key, value in fields.items()}}}
+    context = _Context('projects/benchmark/databases/(default)/documents/' + path)
+
+    def run() -> bool:
+        main.place_order_api(event, context)
+        return db.document(path).get().to_dict().get('status') == 'sent'
+
+    return run
+
+
+def _update_market_price_request(main, db, index: int) -> Callable[[], bool]:
+    def run() -> bool:
+        main.update_market_price({}, _Context())
+        return True
+
+    return run
+
+
+def _purge_old_market_price_request(main, db, index: int, documents: int = 1000) -> Callable[[], bool]:
+    def seed() -> None:
+        # Expired prices of every market, one per minute like the price job writes them
+        now = int(time.time())
+        for target_market in os.environ['TARGET_MARKETS'].split('|'):
+            currency_pair = "{0}-USD".format(target_market.split('-')[0])
+            db.seed('price_histories/%s-latest-%s' % (currency_pair, index), {
+                'currency_pair': currency_pair, 'rate': 1.0, 'market': target_market, 'timestamp': now})
+            for i in range(documents):
+                db.seed('price_histories/%s-%s-%s' % (currency_pair, index, i), {
+                    'currency_pair': currency_pair, 'rate': 1.0, 'market': target_market,
+                    'timestamp': now - 3 * 86400 - 60 * (i + 1)})
+
+    def run() -> bool:
+        main.purge_old_market_price({}, _Context())
+        return True
+
+    run.setup = seed
+    return run
+
+
+def run_benchmark(
+    scenario: str,
+    requests: int = 100,
+    concurrency: int = 4,
+    exchange_latency: float = 0.02,
+    exchange_error_rate: float = 0.0,
+    firestore_latency: float = 0.005,
+    purge_documents: int = 1000,
+    exchange_order_rate: float = None) -> Dict[str, object]:
+    """Drive an entry point at controlled concurrency and report its latency
+
+    Args:
+        scenario (str): one of SCENARIOS
+        requests (int, optional): number of calls of entry point. Defaults to 100.
+        concurrency (int, optional): calls in flight at once. Defaults to 4.
+        exchange_latency (float, optional): mean latency of simulated exchanges in seconds. Defaults to 0.02.
+        exchange_error_rate (float, optional): ratio of exchange requests failing with http 503. Defaults to 0.
+        firestore_latency (float, optional): latency of each fake firestore round trip in seconds. Defaults to 0.005.
+        purge_documents (int, optional): expired documents seeded per market for purge. Defaults to 1000.
+        exchange_order_rate (float, optional): bybit orders accepted per second by simulator. Defaults to no limit.
+
+    Returns:
+        Dict[str, object]: machine readable report
+    """
+    if scenario not in SCENARIOS:
+        raise ValueError('unknown scenario: {}'.format(scenario))
+
+    db = FakeFirestore(firestore_latency)
+    with ExchangeSimulator(
+        exchange_latency, error_rate=exchange_error_rate, order_rate_limit=exchange_order_rate) as simulator:
+        main = load_main(simulator, db)
+
+        latencies: List[float] = []
+
+        calls = []
+        for index in range(requests):
+            if scenario == 'place_order':
+                calls.append(_place_order_request(main, db, index))
+            elif scenario == 'update_market_price':
+                calls.append(_update_market_price_request(main, db, index))
+            else:
+                calls.append(_purge_old_market_price_request(main, db, index, purge_documents))
+
+        def timed(call: Callable[[], bool]) -> bool:
+            # Preparation of a call, if any, is not timed
+            if hasattr(call, 'setup'):
+                call.setup()
+            started = time.perf_counter()
+            try:
+                return call()
+            finally:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        # Output of functions would mix with the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Warm up clients and caches once, like a warm instance
+            db.seed('price_histories/warmup', {
+                'currency_pair': 'BTC-USD', 'rate': simulator.price, 'market': 'BTC-PERP',
+                'timestamp': int(time.time())})
+            main._get_bybit_client().get_next_symbol_name()
+
+            round_trips = db.round_trips
+            exchange_requests = simulator.requests
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(timed, calls))
+            elapsed = time.perf_counter() - started
+        failures = results.count(False)
+        firestore_round_trips = db.round_trips - round_trips
+        queued = len(list(db.collection_group('history').where('status', '==', 'queued').stream()))
+
+        return {
+            'scenario': scenario,
+            'requests': requests,
+            'concurrency': concurrency,
+            'failures': failures,
+            'queued': queued,
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(requests / elapsed, 2) if elapsed else 0.0,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 2),
+                'p95': round(percentile(latencies, 95), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                'max': round(max(latencies), 2) if latencies else 0.0,
+            },
+            'exchange_requests': simulator.requests - exchange_requests,
+            'firestore_round_trips': firestore_round_trips,
+            'config': {
+                'exchange_latency_s': exchange_latency,
+                'exchange_error_rate': exchange_error_rate,
+                'firestore_latency_s': firestore_latency,
+                'exchange_order_rate': exchange_order_rate,
+            }
+        }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--exchange-latency', type=float, default=0.02)
+    parser.add_argument('--exchange-error-rate', type=float, default=0.0)
+    parser.add_argument('--firestore-latency', type=float, default=0.005)
+    parser.add_argument('--purge-documents', type=int, default=1000)
+    parser.add_argument('--exchange-order-rate', type=float, default=None)
+    parser.add_argument('--output', help='write json report to file instead of stdout')
+    args = parser.parse_args(argv)
+
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    reports = [
+        run_benchmark(
+            scenario,
+            args.requests,
+            args.concurrency,
+            args.exchange_latency,
+            args.exchange_error_rate,
+            args.firestore_latency,
+            args.purge_documents,
+            args.exchange_order_rate)
+        for scenario in scenarios
+    ]
+
+    output = json.dumps(reports, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+from bybit_client import BybitClient
+from instrument_catalog import InstrumentCatalog
+from transport import RateLimitError, get_transport
+
+
+class SimBybitClient(BybitClient):
+
+    def __init__(self, base_url: str) -> None:
+        """Bybit client talking to `ExchangeSimulator` instead of bybit
+
+        Args:
+            base_url (str): url of simulator
+        """
+        self._base_url = base_url
+        self._transport = get_transport('bybit')
+        self._catalog = InstrumentCatalog(self.get_all_symbols)
+
+    def get_all_symbols(self) -> list:
+        response = self._transport.request('GET', self._base_url + '/v2/public/symbols')
+        response.raise_for_status()
+        return response.json()['result']
+
+    def place_order(
+        self,
+        symbol: str,
+        side: str,
+        qty: int,
+        order_type: str = 'Market',
+        time_in_force='GoodTillCancel',
+        order_link_id: str = None) -> dict:
+        body = {
+            'symbol': symbol,
+            'side': side.title(),
+            'qty': qty,
+            'order_type': order_type.title(),
+            'time_in_force': time_in_force
+        }
+        if order_link_id is not None:
+            body['order_link_id'] = order_link_id
+        response = self._transport.request('POST', self._base_url + '/v2/private/order/create', json=body)
+        response.raise_for_status()
+        data = response.json()
+        if data['ret_code'] in (10006, 10018):
+            raise RateLimitError(data['ret_msg'])
+        if data['result'] is not None:
+            return data['result']
+        else:
+            raise Exception(data['ret_msg'])
+
+    def find_order(self, symbol: str, order_link_id: str) -> dict:
+        response = self._transport.request('GET', self._base_url + '/v2/private/order', params={
+            'symbol': symbol,
+            'order_link_id': order_link_id
+        })
+        response.raise_for_status()
+        data = response.json()
+        if data['ret_code'] == 20001:
+            return None
+        elif data['result'] is not None:
+            return data['result']
+        else:
+            raise Exception(data['ret_msg'])
+
+
+class FtxClient:
+
+    def __init__(self, base_url: str, api_key: str = None, api_secret: str = None, subaccount_name: str = None) -> None:
+        """FTX client talking to `ExchangeSimulator` instead of ftx
+
+        Args:
+            base_url (str): url of simulator
+        """
+        self._base_url = base_url.rstrip('/')
+        self._transport = get_transport('ftx')
+
+    def get_single_market_price(self, market: str) -> float:
+        response = self._transport.request('GET', self._base_url + '/api/markets/' + market)
+        response.raise_for_status()
+        return response.json()['result']['price']
+
+    def place_order(self, market: str, side: str, size: float, type: str = 'market', price: float = None) -> dict:
+        response = self._transport.request('POST', self._base_url + '/api/orders', json={
+            'market': market,
+            'side': side,
+            'size': size,
+            'type': type,
+            'price': price
+        })
+        response.raise_for_status()
+        return response.json()['result']
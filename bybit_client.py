@@ -1,5 +1,14 @@
 import bybit
-import datetime
+from instrument_catalog import InstrumentCatalog, ResolvedContracts
+from typing import Dict, Iterable, Optional
+from tracing import record_payload, span
+from transport import RateLimitError, get_transport
+
+# ret_code returned by bybit when request rate limit is exceeded
+_RATE_LIMIT_CODES = (10006, 10018)
+
+# ret_code returned by bybit when queried order doesn't exist
+_ORDER_NOT_FOUND_CODE = 20001
 
 
 class BybitClient:
@@ -14,6 +23,24 @@ class BybitClient:
         """
         self._client = bybit.bybit(test=test, api_key=api_key, api_secret=api_secret)
 
+        # All bybit clients of this instance share connections and rate limit
+        self._transport = get_transport('bybit')
+        http_client = getattr(self._client.swagger_spec, 'http_client', None)
+        if getattr(http_client, 'session', None) is not None:
+            self._transport.mount(http_client.session)
+
+        # Catalog lives as long as the client, so it is reused across warm invocations
+        self._catalog = InstrumentCatalog(self.get_all_symbols)
+
+    def get_all_symbols(self) -> list:
+        """Get all symbols listed on exchange
+
+        Returns:
+            list: list of symbols with dictonary of fields
+        """
+        return self._call(
+            'Symbol_get', self._client.Symbol.Symbol_get, idempotent=True, key='Symbol_get')['result']
+
     def get_next_symbol_name(self, base_currency='BTC', quote_currency='USD') -> str:
         """Get name of next enabled and non-expired symbol
 
@@ -24,18 +51,22 @@ class BybitClient:
         Returns:
             str: Returns the name of next enabled and non-expired symbol
         """
-        current_year = datetime.datetime.utcnow().strftime('%y')
-        current_month_year = datetime.datetime.utcnow().strftime('%m%d')
-        all_symbols = self._client.Symbol.Symbol_get().result()[0]['result']
-        future_symbols = [symbol for symbol in all_symbols if 
-                        symbol['base_currency'] == base_currency and 
-                        symbol['quote_currency'] == quote_currency and 
-                        symbol['status'] == 'Trading' and 
-                        symbol['name'].startswith(base_currency + quote_currency) and 
-                        symbol['name'].endswith(current_year) and
-                        int(symbol['alias'][6:]) >= int(current_month_year) ]
-        
-        return min(future_symbols, key=lambda symbol:int(symbol['alias'][6:]))['name']
+        return self._catalog.get_next_symbol_name(base_currency, quote_currency)
+
+    def resolve_contracts(
+        self,
+        base_currencies: Iterable[str],
+        quote_currency: str = 'USD') -> Dict[str, ResolvedContracts]:
+        """Get front and next enabled and non-expired contract of several base currencies
+
+        Args:
+            base_currencies (Iterable[str]): Base currencies (eg: ['BTC', 'ETH'])
+            quote_currency (str, optional): Quote currency. Defaults to 'USD'.
+
+        Returns:
+            Dict[str, ResolvedContracts]: contracts by base currency
+        """
+        return self._catalog.resolve(base_currencies, quote_currency)
 
     def place_order(
         self, 
@@ -43,7 +74,8 @@ class BybitClient:
         side: str, 
         qty: int, 
         order_type: str='Market',
-        time_in_force='GoodTillCancel') -> dict:
+        time_in_force='GoodTillCancel',
+        order_link_id: str = None) -> dict:
         """Place an order
 
         Args:
@@ -52,18 +84,70 @@ class BybitClient:
             qty (int): qty/size of order
             order_type (str, optional): Order type (Limit, Market etc). Defaults to 'Market'.
             time_in_force (str, optional): Time in force (GoodTillCancel/ImmediateOrCancel/FillOrKill/PostOnly). Defaults to GoodTillCancel.
+            order_link_id (str, optional): unique id of order set by us, to find it later. Defaults to None.
 
         Returns:
             dict: returns the successfully placed order with dictonary of fields
         """
-        data = self._client.FuturesOrder.FuturesOrder_new(
+        params = {}
+        if order_link_id is not None:
+            params['order_link_id'] = order_link_id
+        data = self._call('FuturesOrder_new', lambda: self._client.FuturesOrder.FuturesOrder_new(
             symbol=symbol,
             side=side.title(),
             qty=qty,
             order_type=order_type.title(),
-            time_in_force=time_in_force).result()[0]
+            time_in_force=time_in_force,
+            **params))
 
         if data['result'] is not None:
             return data['result']
         else:
-            raise Exception(data['ret_msg'])
\ No newline at end of file
+            raise Exception(data['ret_msg'])
+
+    def find_order(self, symbol: str, order_link_id: str) -> Optional[dict]:
+        """Find an order placed in last 7 days by the id we set on it
+
+        Args:
+            symbol (str): name of symbol (eg:BTCUSDZ21)
+            order_link_id (str): id set when order was placed
+
+        Returns:
+            Optional[dict]: order with dictonary of fields, None if there is no such order
+        """
+        data = self._call('FuturesOrder_query', lambda: self._client.FuturesOrder.FuturesOrder_query(
+            symbol=symbol,
+            order_link_id=order_link_id), idempotent=True)
+
+        if data['ret_code'] == _ORDER_NOT_FOUND_CODE:
+            return None
+        elif data['result'] is not None:
+            return data['result'] or None
+        else:
+            raise Exception(data['ret_msg'])
+
+    def _call(self, name: str, operation, idempotent: bool = False, key: object = None) -> dict:
+        """Call a bravado operation through shared transport and follow reported rate limit
+
+        Args:
+            name (str): name of operation, used in trace span
+            operation (Callable): function returning the bravado future of the call
+            idempotent (bool, optional): retry transient failures. Defaults to False.
+            key (object, optional): identical calls in flight with same key share one call.
+
+        Returns:
+            dict: response body
+        """
+        def send() -> dict:
+            data, response = operation().result()
+            record_payload(len(getattr(response, 'raw_bytes', None) or b''))
+            self._transport.update_limits(getattr(response, 'headers', None))
+            if data.get('rate_limit_status') is not None:
+                reset_ms = data.get('rate_limit_reset_ms')
+                self._transport.limiter.update(data['rate_limit_status'], reset_ms / 1000 if reset_ms else None)
+            if data.get('ret_code') in _RATE_LIMIT_CODES:
+                raise RateLimitError(data['ret_msg'])
+            return data
+
+        with span('bybit.' + name):
+            return self._transport.call(send, idempotent, key)
@@ -1,7 +1,121 @@
+from balances import BalanceRecord, write_balance_records
+from dataclasses import dataclass
+from google.api_core import exceptions
 from google.cloud import firestore
+from price_buckets import STORAGE_MODES, add_price, bucket_id
+from price_cache import PriceCache
+from price_series import PriceSeries
+from sharded_scan import partition_queries, scan_partitions, stream_partitions
+from stats import SETTLED_STATUSES, ConversionStats, InterestStats
+from tracing import record_retry, span, traced
+from typing import Dict, Iterator, Optional, TextIO
+import contextlib
 import datetime
+import hashlib
+import itertools
+import os
+import sys
+import threading
 import time
 
+# Maximum number of writes allowed in a single firestore batch
+MAX_BATCH_SIZE = 500
+
+# Transient errors on which a batch commit is retried
+_RETRYABLE_ERRORS = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable)
+
+# Sub-collections under each user holding conversion and interest payment rows
+CONVERT_HISTORY_GROUP = os.environ.get('CONVERT_HISTORY_GROUP', 'history')
+INTEREST_HISTORY_GROUP = os.environ.get('INTEREST_HISTORY_GROUP', 'history')
+
+# Fields changed whenever a conversion or interest payment row is added or updated,
+# used as high-water mark of incremental stats. `updated_at` is set by every status
+# write of this repository.
+CONVERT_HISTORY_CHECKPOINT_FIELD = os.environ.get('CONVERT_HISTORY_CHECKPOINT_FIELD', 'updated_at')
+INTEREST_HISTORY_CHECKPOINT_FIELD = os.environ.get('INTEREST_HISTORY_CHECKPOINT_FIELD', 'datetime')
+
+# Key-range partitions a collection scan is split into, and partitions scanned at once
+SCAN_PARTITIONS = int(os.environ.get('SCAN_PARTITIONS', 8))
+SCAN_CONCURRENCY = int(os.environ.get('SCAN_CONCURRENCY', 8))
+
+# Seconds before the purge bound first probed for expired prices, doubled until no price
+# is older. Daily purges find expired prices within one day.
+_PURGE_PROBE_SPAN = 86400
+
+# Rows folded into materialized stats per committed batch
+_STATS_CHUNK_SIZE = 100
+
+# Storage of price history, 'documents' (one document per price in `price_histories`)
+# or 'buckets' (one document per market per hour in `price_buckets`)
+PRICE_HISTORY_STORAGE = os.environ.get('PRICE_HISTORY_STORAGE', 'documents')
+if PRICE_HISTORY_STORAGE not in STORAGE_MODES:
+    raise ValueError('PRICE_HISTORY_STORAGE must be one of %s' % (STORAGE_MODES,))
+
+# Read-through cache of latest price per currency pair, shared by all records of this
+# instance: get_market_price fills it on a miss, and a cached price is served until it is
+# older (from its timestamp) than max age. Max age stays below the 60 seconds between two
+# runs of UpdatePriceHistory, so a cached price is never older than the newest one in firestore.
+latest_prices = PriceCache(float(os.environ.get('PRICE_CACHE_MAX_AGE', 50)))
+
+# Seconds of price history loaded into a price series, and seconds during which
+# a price series is served without querying firestore for newer prices
+PRICE_SERIES_WINDOW = int(os.environ.get('PRICE_SERIES_WINDOW', 86400))
+PRICE_SERIES_REFRESH_INTERVAL = float(os.environ.get('PRICE_SERIES_REFRESH_INTERVAL', 30))
+
+# Price series per currency pair, shared by all records of this instance
+_price_series: Dict[str, PriceSeries] = {}
+_price_series_lock = threading.Lock()
+
+@dataclass
+class PurgeStats:
+    """Throughput of a purge run"""
+    currency_pair: str
+    deleted: int = 0
+    batches: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def docs_per_second(self) -> float:
+        return self.deleted / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return '%s: deleted %s documents in %s batches (%s retries) in %.2fs, %.1f docs/s' % (
+            self.currency_pair, self.deleted, self.batches, self.retries, self.elapsed, self.docs_per_second)
+
+_db = None
+_db_lock = threading.Lock()
+
+def get_firestore_client() -> firestore.Client:
+    """Get firestore client shared by all records of this instance.
+
+    Returns:
+        firestore.Client: shared client
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                # Project ID is determined by the GCP_PROJECT environment variable
+                _db = firestore.Client()
+    return _db
+
+def set_firestore_client(client) -> None:
+    """Replace firestore client shared by all records of this instance
+    (eg: with an in-memory fake for benchmarks).
+
+    Args:
+        client (firestore.Client): client
+    """
+    global _db
+    with _db_lock:
+        _db = client
+
 class DbRecords:
 
     def __init__(self, doc_path: str = None) -> None:
@@ -11,14 +125,63 @@ class DbRecords:
             doc_path (str): Path of document in a collection
         """
 
-        # Project ID is determined by the GCP_PROJECT environment variable
-        self._db = firestore.Client()
+        self._db = get_firestore_client()
+        self._write_batch = None
 
         if doc_path:
             path_parts = doc_path.split('/documents/')[1].split('/')
             self._collection_path = path_parts[0]
             self._document_path = '/'.join(path_parts[1:])
 
+    @contextlib.contextmanager
+    def batch(self):
+        """Collect all writes made within the block and commit them at once in a
+        single `WriteBatch` when the block exits. If the block raises, nothing is written.
+
+        Yields:
+            DbRecords: self
+        """
+        if self._write_batch is not None:
+            # Nested block joins the outer batch
+            yield self
+            return
+
+        self._write_batch = self._db.batch()
+        try:
+            yield self
+            with span('firestore.batch_commit', writes=len(self._write_batch)):
+                self._write_batch.commit()
+        finally:
+            self._write_batch = None
+
+    # Writes staged in a batch are traced by the span of its commit
+
+    def _add(self, col_ref, data: dict) -> None:
+        if self._write_batch is not None:
+            self._write_batch.set(col_ref.document(), data)
+        else:
+            with span('firestore.add', collection=col_ref.id):
+                col_ref.add(data)
+
+    def _update(self, doc_ref, data: dict) -> None:
+        if self._write_batch is not None:
+            self._write_batch.update(doc_ref, data)
+        else:
+            with span('firestore.update', collection=doc_ref.parent.id):
+                doc_ref.update(data)
+
+    def _merge(self, doc_ref, data: dict) -> None:
+        if self._write_batch is not None:
+            self._write_batch.set(doc_ref, data, merge=True)
+        else:
+            with span('firestore.merge', collection=doc_ref.parent.id):
+                doc_ref.set(data, merge=True)
+
+    def _price_collection(self):
+        if PRICE_HISTORY_STORAGE == 'buckets':
+            return self._db.collection("price_buckets")
+        return self._db.collection("price_histories")
+
     def add_convert_history_order_document_on_success(
         self,
         exchange: str,
@@ -37,7 +200,7 @@ class DbRecords:
             createdAt (str): order creation date & time
         """
         col_ref = self._db.collection(self._collection_path).document(self._document_path).collection(u'order')
-        col_ref.add({
+        self._add(col_ref, {
             u'exchange': exchange,
             u'id': id,
             u'future': future,
@@ -54,29 +217,205 @@ class DbRecords:
         """
 
         col_ref = self._db.collection(self._collection_path).document(self._document_path).collection(u'order')
-        col_ref.add({u'error': error})
+        self._add(col_ref, {u'error': error})
+
+    @traced('firestore.begin_order_journal')
+    def begin_order_journal(self) -> Optional[dict]:
+        """Journal that orders of history document are about to be placed, before placing them.
+
+        Journal entry is keyed by path of history document, so a replayed trigger of the
+        same document finds the entry of its first run.
+
+        Returns:
+            Optional[dict]: None on first run, otherwise fields of history document
+        """
+        path = self._collection_path + '/' + self._document_path
+        doc_ref = self._journal_ref()
+        try:
+            doc_ref.create({u'path': path, u'created_at': int(time.time())})
+            return None
+        except exceptions.AlreadyExists:
+            snapshot = self._db.collection(self._collection_path).document(self._document_path).get()
+            return snapshot.to_dict() or {}
+
+    @traced('firestore.journal_order_symbol')
+    def journal_order_symbol(self, exchange: str, symbol: str) -> None:
+        """Journal symbol of an order before placing it, so a replayed trigger looks the order
+        up on that symbol even if it rolled to another contract since. Written at once, even
+        within a `batch()` block.
+
+        Args:
+            exchange (str): exchange of order (eg: bybit)
+            symbol (str): symbol of order (eg: BTCUSDZ21)
+        """
+        self._journal_ref().set({u'symbols': {exchange: symbol}}, merge=True)
+
+    @traced('firestore.journaled_order_symbol')
+    def journaled_order_symbol(self, exchange: str) -> Optional[str]:
+        """Get symbol journaled by `journal_order_symbol`
+
+        Args:
+            exchange (str): exchange of order (eg: bybit)
+
+        Returns:
+            Optional[str]: symbol, None if no order of exchange was about to be placed
+        """
+        snapshot = self._journal_ref().get()
+        return ((snapshot.to_dict() or {}).get(u'symbols') or {}).get(exchange) if snapshot.exists else None
+
+    @traced('firestore.recorded_order_exchanges')
+    def recorded_order_exchanges(self) -> set:
+        """Get exchanges of orders already recorded under history document
+
+        Returns:
+            set: exchanges (eg: {'ftx'})
+        """
+        col_ref = self._db.collection(self._collection_path).document(self._document_path).collection(u'order')
+        return {
+            doc.to_dict()[u'exchange'] for doc in col_ref.select([u'exchange']).stream()
+            if (doc.to_dict() or {}).get(u'exchange')}
+
+    @traced('firestore.delete_old_order_journal_documents')
+    def delete_old_order_journal_documents(self, retention: int, page_size: int = MAX_BATCH_SIZE) -> PurgeStats:
+        """Delete order journal entries created more than `retention` seconds ago, by when
+        their triggers are no longer retried
+
+        Args:
+            retention (int): seconds entries are kept
+            page_size (int, optional): Documents deleted per batch. Defaults to 500.
+
+        Returns:
+            PurgeStats: throughput of purge
+        """
+        stats = PurgeStats(u'order_journal')
+        started = time.time()
+        page_size = min(page_size, MAX_BATCH_SIZE)
+        query = self._db.collection(u'order_journal') \
+            .where(u'created_at', u'<', int(time.time()) - retention) \
+            .select([u'created_at']).limit(page_size)
+
+        # Deleted entries no longer match, so first page is always next one
+        while True:
+            docs = list(query.stream())
+            if not docs:
+                break
+            self._commit_deletes([doc.reference for doc in docs], 5, stats)
+            stats.deleted += len(docs)
+            stats.batches += 1
+            if len(docs) < page_size:
+                break
+
+        stats.elapsed = time.time() - started
+        return stats
+
+    def _journal_ref(self):
+        path = self._collection_path + '/' + self._document_path
+        return self._db.collection(u'order_journal').document(hashlib.sha1(path.encode()).hexdigest())
 
-    def update_convert_history_document(self, status: str) -> None:
+    def update_convert_history_document(self, status: str, latency: dict = None) -> None:
         """Update status of history document after order is successfully created 
         or encounter an error
 
         Args:
             status (str): status (eg: sent/error)
+            latency (dict, optional): latency of each order stage in milliseconds
         """
 
         doc_ref = self._db.collection(self._collection_path).document(self._document_path)
         now = datetime.datetime.now()
-        doc_ref.update({
+        data = {
             u'status': status,
-            u'datetime': now.strftime("%Y-%m-%d %H:%M:%S")})
-        
+            u'datetime': now.strftime("%Y-%m-%d %H:%M:%S"),
+            u'updated_at': int(time.time() * 1000)}
+        if latency is not None:
+            data[u'latency'] = latency
+        self._update(doc_ref, data)
+
+    def queue_convert_history_document(
+        self,
+        attempts: int,
+        legs: tuple,
+        reason: str,
+        latency: dict = None) -> None:
+        """Update status of history document to 'queued' when some of its orders were deferred
+        without going out, so they are placed later by the requeue job
+
+        Args:
+            attempts (int): number of attempts rejected by exchange rate limit so far
+            legs (tuple): exchanges whose orders were deferred (eg: ('bybit', 'ftx'))
+            reason (str): why orders were deferred
+            latency (dict, optional): latency of each order stage in milliseconds
+        """
+
+        doc_ref = self._db.collection(self._collection_path).document(self._document_path)
+        now = datetime.datetime.now()
+        data = {
+            u'status': 'queued',
+            u'queued_at': int(time.time() * 1000),
+            u'queued_legs': list(legs),
+            u'queued_reason': reason,
+            u'attempts': attempts,
+            u'datetime': now.strftime("%Y-%m-%d %H:%M:%S"),
+            u'updated_at': int(time.time() * 1000)}
+        if latency is not None:
+            data[u'latency'] = latency
+        self._update(doc_ref, data)
+
+    @traced('firestore.claim_queued_order')
+    def claim_queued_order(self, update_time) -> bool:
+        """Claim a queued history document (or one whose claim expired) for placing its
+        orders, setting its status to 'claimed' with `claimed_at`. The update is conditional
+        on the document being unchanged since it was read, so concurrent requeue runs can't
+        both claim it.
+
+        Args:
+            update_time: update time of history document when it was read
+
+        Returns:
+            bool: True if claimed, False if document changed since (eg: claimed by another run)
+        """
+        doc_ref = self._db.collection(self._collection_path).document(self._document_path)
+        now = int(time.time() * 1000)
+        try:
+            doc_ref.update(
+                {u'status': 'claimed', u'claimed_at': now, u'updated_at': now},
+                option=self._db.write_option(last_update_time=update_time))
+            return True
+        except (exceptions.FailedPrecondition, exceptions.NotFound):
+            return False
+
+    @traced('firestore.queued_convert_histories')
+    def queued_convert_histories(
+        self,
+        claim_lease: int,
+        group_id: str = CONVERT_HISTORY_GROUP,
+        limit: int = 500) -> list:
+        """Get history documents whose orders are queued, oldest queued first, followed by
+        claimed ones whose claim is older than `claim_lease` (eg: requeue run crashed)
+
+        Args:
+            claim_lease (int): seconds after which a claim expires
+            group_id (str, optional): id of history sub-collections. Defaults to CONVERT_HISTORY_GROUP.
+            limit (int, optional): maximum number of documents of each kind. Defaults to 500.
+
+        Returns:
+            list: document snapshots
+        """
+        group = self._db.collection_group(group_id)
+        queued = group.where(u'status', u'==', 'queued').order_by(u'queued_at').limit(limit)
+        expired = group.where(u'status', u'==', 'claimed') \
+            .where(u'claimed_at', u'<', int((time.time() - claim_lease) * 1000)).order_by(u'claimed_at').limit(limit)
+        return list(queued.stream()) + list(expired.stream())
+
     def add_price_history_document(
         self,
         currency_pair: str, 
         rate: float, 
         market: str, 
         source: str = 'FTX') -> None:
-        """Add a document to `price_histories` collection.
+        """Add a document to `price_histories` collection, or in `buckets` storage
+        add the price to the hourly bucket of the currency pair in `price_buckets`
+        collection.
 
         Args:
             currency_pair (str): Currency pair used by user (eg: USD-BTC)
@@ -84,26 +423,50 @@ class DbRecords:
             source (str): Exchange (eg: FTX)
             market (str): Market used to get the price (eg: BTC-PERP)
         """
-        col_ref = self._db.collection("price_histories")
-        col_ref.add({
+        timestamp = int(time.time())
+        data = {
             u'currency_pair': currency_pair,
             u'rate': rate,
             u'source': source,
             u'market': market,
-            u'timestamp': int(time.time())
-        })
+            u'timestamp': timestamp
+        }
+
+        if PRICE_HISTORY_STORAGE == 'buckets':
+            # Blind merge, so adding a price costs one write and no read
+            doc_ref = self._price_collection().document(bucket_id(currency_pair, timestamp))
+            data.update(add_price(timestamp, rate))
+            self._merge(doc_ref, data)
+        else:
+            self._add(self._price_collection(), data)
+        # Only readers of this instance see it, other instances read it through on their next miss
+        latest_prices.put(currency_pair, rate, timestamp)
         
+    @traced('firestore.delete_old_price_history_documents')
     def delete_old_price_history_documents(
         self,
-        currency_pair: str):
-        """Delete all old documents created 3 days before.
+        currency_pair: str,
+        page_size: int = MAX_BATCH_SIZE,
+        max_retries: int = 5) -> PurgeStats:
+        """Delete all old documents created 3 days before. In `buckets` storage,
+        whole hourly buckets last updated 3 days before are deleted.
+
+        Expired documents are split into timestamp ranges purged concurrently, each
+        paged through with a cursor and deleted in batches of up to `page_size` documents.
 
         Args:
             currency_pair (str): Currency pair used by user (eg: USD-BTC)
+            page_size (int, optional): Documents deleted per batch. Defaults to 500.
+            max_retries (int, optional): Retries of a failed batch commit. Defaults to 5.
+
+        Returns:
+            PurgeStats: throughput of purge
         """
+        stats = PurgeStats(currency_pair)
+        started = time.time()
         
         # Retrive the latest document for a given curreny pair
-        col_ref = self._db.collection("price_histories")
+        col_ref = self._price_collection()
         queryWhere = col_ref.where(u'currency_pair', u'==', currency_pair)
         queryOrderBy = queryWhere.order_by(u'timestamp', direction=firestore.Query.DESCENDING)
         queryLimt = queryOrderBy.limit(1)
@@ -116,142 +479,542 @@ class DbRecords:
         
         # No action to take
         if lastTimestamp == 0:
-            return
+            return stats
 
         # Retrieve all old documents created before 3 day
         lastDay = datetime.datetime.fromtimestamp(lastTimestamp)
         oneDayAgo = lastDay - datetime.timedelta(3)
         newTimestamp = int(oneDayAgo.timestamp())
      
-        # Delete all old documents created before 3 day
-        col_ref = self._db.collection("price_histories")
-        queryWhere = col_ref.where(u'currency_pair', u'==', currency_pair).where(u'timestamp', u'<=', newTimestamp)
+        # Find a lower bound of expired documents, to split them into timestamp ranges. Older
+        # and older bounds are probed newest first, so only the descending index is needed.
+        def newest_before(bound: int) -> Optional[int]:
+            queryBefore = queryWhere.where(u'timestamp', u'<', bound) \
+                .order_by(u'timestamp', direction=firestore.Query.DESCENDING)
+            for doc in queryBefore.select([u'timestamp']).limit(1).stream():
+                return doc.to_dict()['timestamp']
+            return None
+
+        # No action to take
+        if newest_before(newTimestamp + 1) is None:
+            stats.elapsed = time.time() - started
+            return stats
+
+        probe_span = _PURGE_PROBE_SPAN
+        firstTimestamp = max(newTimestamp - probe_span, 0)
+        while firstTimestamp > 0 and newest_before(firstTimestamp) is not None:
+            probe_span *= 2
+            firstTimestamp = max(newTimestamp - probe_span, 0)
+
+        # Delete all old documents created before 3 day, each timestamp range concurrently
+        partitions = max(min(SCAN_PARTITIONS, newTimestamp - firstTimestamp + 1), 1)
+        step = (newTimestamp - firstTimestamp + 1) / partitions
+        bounds = [firstTimestamp + int(step * i) for i in range(partitions)] + [newTimestamp + 1]
+        ranges = [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+        def purge(time_range: tuple) -> PurgeStats:
+            return self._delete_price_range(
+                col_ref, currency_pair, time_range[0], time_range[1], page_size, max_retries)
+
+        for partial in scan_partitions(ranges, purge, SCAN_CONCURRENCY):
+            stats.deleted += partial.deleted
+            stats.batches += partial.batches
+            stats.retries += partial.retries
+
+        stats.elapsed = time.time() - started
+        return stats
+
+    def _delete_price_range(
+        self,
+        col_ref,
+        currency_pair: str,
+        start: int,
+        end: int,
+        page_size: int,
+        max_retries: int) -> PurgeStats:
+        """Delete documents of a currency pair with timestamp in [start, end), one page at a time
+        """
+        stats = PurgeStats(currency_pair)
+        page_size = min(page_size, MAX_BATCH_SIZE)
+        queryWhere = col_ref.where(u'currency_pair', u'==', currency_pair) \
+            .where(u'timestamp', u'>=', start).where(u'timestamp', u'<', end)
         queryOrderBy = queryWhere.order_by(u'timestamp', direction=firestore.Query.DESCENDING)
-        docs = queryOrderBy.stream()
-        for doc in docs:
-           doc.reference.delete()
+        queryPage = queryOrderBy.select([u'timestamp']).limit(page_size)
+
+        cursor = None
+        while True:
+            query = queryPage.start_after(cursor) if cursor else queryPage
+            docs = list(query.stream())
+            if not docs:
+                break
+
+            self._commit_deletes([doc.reference for doc in docs], max_retries, stats)
+            stats.deleted += len(docs)
+            stats.batches += 1
+            cursor = docs[-1]
+
+            if len(docs) < page_size:
+                break
+
+        return stats
+
+    def _commit_deletes(self, doc_refs: list, max_retries: int, stats: PurgeStats) -> None:
+        attempt = 0
+        while True:
+            batch = self._db.batch()
+            for doc_ref in doc_refs:
+                batch.delete(doc_ref)
+            try:
+                batch.commit()
+                return
+            except _RETRYABLE_ERRORS:
+                if attempt >= max_retries:
+                    raise
+                attempt += 1
+                stats.retries += 1
+                record_retry()
+                time.sleep(min(2 ** attempt * 0.1, 5))
     
+    @traced('firestore.get_market_price')
     def get_market_price(
         self,
-        currency_pair: str) -> float:
+        currency_pair: str,
+        max_age: float = None) -> float:
         """ Get market price for a given currency pair
 
+        Price is served from the in-memory cache of latest prices, and firestore
+        is queried only on a miss or if cached price is stale.
+
         Args:
             currency_pair (str): curreny pair (eg: BTC-USD)
+            max_age (float, optional): staleness bound in seconds. Defaults to cache's bound.
 
         Returns:
             float: market price
         """
+        rate = latest_prices.get(currency_pair, max_age)
+        if rate is not None:
+            return rate
         
-         # Retrive the latest document for a given curreny pair
-        col_ref = self._db.collection("price_histories")
+         # Retrive the latest document (or bucket) for a given curreny pair
+        col_ref = self._price_collection()
         queryWhere = col_ref.where(u'currency_pair', u'==', currency_pair)
         queryOrderBy = queryWhere.order_by(u'timestamp', direction=firestore.Query.DESCENDING)
-        queryLimt = queryOrderBy.limit(1)
+        queryLimt = queryOrderBy.select([u'rate', u'timestamp']).limit(1)
         docs = queryLimt.stream()
         
         rate : float = 0
         for doc in docs:
-            rate = doc.to_dict()['rate']
+            doc_params = doc.to_dict()
+            rate = doc_params['rate']
+            latest_prices.put(currency_pair, rate, doc_params['timestamp'])
             break
     
         return rate
  
+    @traced('firestore.get_price_series')
+    def get_price_series(
+        self,
+        currency_pair: str,
+        refresh_interval: float = None,
+        page_size: int = MAX_BATCH_SIZE) -> PriceSeries:
+        """ Get recent prices of a currency pair as a numpy backed series
+
+        The series is loaded once per instance with a paginated, projected query,
+        and then only extended with prices newer than its newest price.
+
+        Args:
+            currency_pair (str): curreny pair (eg: BTC-USD)
+            refresh_interval (float, optional): seconds during which series is served without
+                querying newer prices. Defaults to PRICE_SERIES_REFRESH_INTERVAL.
+            page_size (int, optional): documents read per query. Defaults to 500.
+
+        Returns:
+            PriceSeries: price series
+        """
+        refresh_interval = PRICE_SERIES_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        with _price_series_lock:
+            series = _price_series.get(currency_pair)
+            if series is None:
+                series = _price_series[currency_pair] = PriceSeries(currency_pair, max(PRICE_SERIES_WINDOW // 60, 1))
+
+        # Concurrent callers may both refresh, extending skips prices already added
+        now = time.time()
+        if now - series.refreshed < refresh_interval:
+            return series
+        series.refreshed = now
+
+        since = series.last_timestamp or int(now) - PRICE_SERIES_WINDOW
+        col_ref = self._price_collection()
+        queryWhere = col_ref.where(u'currency_pair', u'==', currency_pair).where(u'timestamp', u'>', since)
+        # Descending, so the composite index used by get_market_price serves this query too
+        queryOrderBy = queryWhere.order_by(u'timestamp', direction=firestore.Query.DESCENDING)
+        if PRICE_HISTORY_STORAGE == 'buckets':
+            queryPage = queryOrderBy.select([u'start', u'prices', u'timestamp']).limit(page_size)
+        else:
+            queryPage = queryOrderBy.select([u'rate', u'timestamp', u'volume']).limit(page_size)
+
+        pages = []
+        cursor = None
+        while True:
+            query = queryPage.start_after(cursor) if cursor else queryPage
+            docs = list(query.stream())
+            if not docs:
+                break
+            pages.append(docs)
+            cursor = docs[-1]
+
+            if len(docs) < page_size:
+                break
+
+        # Series is extended oldest first
+        timestamps, rates, volumes = [], [], []
+        for docs in reversed(pages):
+            for doc in reversed(docs):
+                doc_params = doc.to_dict()
+                if PRICE_HISTORY_STORAGE == 'buckets':
+                    for minute, rate in sorted(doc_params.get('prices', {}).items()):
+                        timestamps.append(doc_params['start'] + int(minute) * 60)
+                        rates.append(rate)
+                        volumes.append(float('nan'))
+                else:
+                    timestamps.append(doc_params['timestamp'])
+                    rates.append(doc_params['rate'])
+                    volumes.append(doc_params.get('volume', float('nan')))
+        if timestamps:
+            series.extend(timestamps, rates, volumes)
+
+        return series
+
     def isNaN(self, num):
         return num != num
        
-    def calculate_conversions_stats(self) -> None:
-        """Calculate stats
+    @traced('stats.calculate_conversions_stats')
+    def calculate_conversions_stats(self, group_id: str = CONVERT_HISTORY_GROUP) -> ConversionStats:
+        """Calculate conversion stats in a single pass over all conversion history rows,
+        split into partitions scanned concurrently
+
+        Args:
+            group_id (str, optional): Sub-collection holding conversion history rows. Defaults to 'history'.
+
+        Returns:
+            ConversionStats: conversion stats
         """
+        def fold(query) -> ConversionStats:
+            partial = ConversionStats()
+            for _, uid, row in self._history_rows(query, "convert_history"):
+                partial.add(uid, row)
+            return partial
 
-        user = {}
-        col_ref = self._db.collection("convert_history")
-        docs = col_ref.stream()
-        
-        total_users = 0
-        total_from_usds_conversions = 0
-        total_to_usds_conversions = 0
-        for doc in docs:
-            total_users = total_users + 1
-            for sub_col_ref in doc.reference.collections():
-                for sub_doc in sub_col_ref.stream():
-                    from_currency = sub_doc.to_dict()['from_currency']
-                    amount = sub_doc.to_dict()['amount']
-                    status = sub_doc.to_dict()['status']
-                    if status != 'done' and status != 'pending':
-                        continue
-                    
-                    rate = sub_doc.to_dict()['rate']
-                    if from_currency == 'USDS':
-                        if 'FROM_USDS' in user:
-                            user['FROM_USDS'] = user['FROM_USDS'] + amount
-                        else:
-                            user['FROM_USDS'] = amount
-                        total_from_usds_conversions = total_from_usds_conversions + 1
-                    else:
-                        if 'TO_USDS' in user:
-                            user['TO_USDS'] =  user['TO_USDS'] + (amount * rate)
-                        else: 
-                            user['TO_USDS'] = amount * rate
-                        total_to_usds_conversions = total_to_usds_conversions + 1
-                     
-        print('Total number of users who performed conversion: {}'.format(total_users))
-        print('[FROM USDS] Total number of conversions: {}'.format(total_from_usds_conversions))
-        print('[FROM USDS] Total amount of conversions: {} USDS'.format(user['FROM_USDS']))
-        print('[TO USDS] Total number of conversions: {}'.format(total_to_usds_conversions))
-        print('[TO USDS] Total amount of conversions: {} USDS'.format(user['TO_USDS']))
-
-    def calculate_total_paid_interest(self) -> None:
-        """Calculate paid interest
+        # Partitions of history are folded concurrently, then merged
+        stats = ConversionStats()
+        fields = [u'from_currency', u'to_currency', u'amount', u'rate', u'status']
+        for partial in scan_partitions(self._partition_group(group_id, fields), fold, SCAN_CONCURRENCY):
+            stats.merge(partial)
+
+        stats.print_summary()
+        return stats
+
+    @traced('stats.calculate_total_paid_interest')
+    def calculate_total_paid_interest(self, group_id: str = INTEREST_HISTORY_GROUP) -> InterestStats:
+        """Calculate paid interest in a single pass over all interest payment rows,
+        split into partitions scanned concurrently
+
+        Args:
+            group_id (str, optional): Sub-collection holding interest payment rows. Defaults to 'history'.
+
+        Returns:
+            InterestStats: interest stats
         """
+        def fold(query) -> InterestStats:
+            partial = InterestStats()
+            for _, uid, row in self._history_rows(query, "interest_payment_histories"):
+                partial.add(uid, row)
+            return partial
 
-        col_ref = self._db.collection("interest_payment_histories")
-        docs = col_ref.stream()
-        
-        total_users = 0
-        total_interest_paid = 0
-        for doc in docs:
-            total_users = total_users + 1
-            for sub_col_ref in doc.reference.collections():
-                for sub_doc in sub_col_ref.stream():
-                    total_interest_paid = total_interest_paid + sub_doc.to_dict()['amount']
+        # Partitions of history are folded concurrently, then merged
+        stats = InterestStats()
+        for partial in scan_partitions(self._partition_group(group_id, [u'amount']), fold, SCAN_CONCURRENCY):
+            stats.merge(partial)
+
+        stats.print_summary()
+        return stats
+
+    @traced('stats.materialize_conversions_stats')
+    def materialize_conversions_stats(self, full_rebuild: bool = False) -> ConversionStats:
+        """Fold conversion history rows added or changed since last run into
+        stats stored in `stats/conversions`
+
+        Args:
+            full_rebuild (bool, optional): Drop stored stats and rebuild them from all rows. Defaults to False.
+
+        Returns:
+            ConversionStats: stored totals, with per-user totals of users touched by this run
+        """
+        stats = self._materialize_stats(
+            u'conversions',
+            "convert_history",
+            CONVERT_HISTORY_GROUP,
+            [u'from_currency', u'to_currency', u'amount', u'rate', u'status'],
+            CONVERT_HISTORY_CHECKPOINT_FIELD,
+            ConversionStats,
+            full_rebuild,
+            SETTLED_STATUSES)
+        stats.print_summary()
+        return stats
+
+    @traced('stats.materialize_interest_stats')
+    def materialize_interest_stats(self, full_rebuild: bool = False) -> InterestStats:
+        """Fold interest payment rows added or changed since last run into
+        stats stored in `stats/interest`
+
+        Args:
+            full_rebuild (bool, optional): Drop stored stats and rebuild them from all rows. Defaults to False.
+
+        Returns:
+            InterestStats: stored totals, with per-user totals of users touched by this run
+        """
+        stats = self._materialize_stats(
+            u'interest',
+            "interest_payment_histories",
+            INTEREST_HISTORY_GROUP,
+            [u'amount'],
+            INTEREST_HISTORY_CHECKPOINT_FIELD,
+            InterestStats,
+            full_rebuild)
+        stats.print_summary()
+        return stats
+
+    def _materialize_stats(
+        self,
+        name: str,
+        collection: str,
+        group_id: str,
+        fields: list,
+        checkpoint_field: str,
+        stats_cls,
+        full_rebuild: bool,
+        settled_statuses: tuple = None):
+        """Incrementally maintain stats of a history collection.
+
+        The stats document holds the totals and the high-water mark of `checkpoint_field`.
+        Its `rows` sub-collection keeps the last folded version of each row, so a changed row
+        is taken back before its new version is added, and `users` keeps per-user totals.
+
+        With `settled_statuses`, rows folded with another status are read again on every run,
+        so status changes by writers not updating `checkpoint_field` (eg: `conversion_batch`
+        marking `sent` as `done`) are folded too.
+        """
+        stats_ref = self._db.collection(u'stats').document(name)
+
+        snapshot = None if full_rebuild else stats_ref.get()
+        if snapshot is not None and snapshot.exists \
+                and snapshot.to_dict().get(u'checkpoint_field', checkpoint_field) != checkpoint_field:
+            # Checkpoint of another field can't be compared, so stats are rebuilt
+            snapshot = None
+        if snapshot is not None and snapshot.exists:
+            stored = snapshot.to_dict()
+            stats = stats_cls.from_dict(stored[u'totals'])
+            checkpoint = stored.get(u'checkpoint')
+        else:
+            print("rebuilding '%s' stats from all rows" % name)
+            for col_ref in (stats_ref.collection(u'rows'), stats_ref.collection(u'users')):
+                self._delete_collection(col_ref)
+            stats = stats_cls()
+            checkpoint = None
+
+        # Rows are read in checkpoint order when resuming, so the high-water mark of each
+        # committed chunk is safe. A rebuild reads rows unordered and only stores its
+        # high-water mark with the last chunk, until then a resumed run reads all rows again.
+        ordered = checkpoint is not None
+        rows = self._stream_history_rows(
+            collection, group_id, fields + [checkpoint_field], checkpoint_field, checkpoint)
+        if ordered and settled_statuses:
+            rows = itertools.chain(rows, self._unsettled_history_rows(stats_ref, fields + [checkpoint_field]))
+
+        loaded_uids = set()
+        folded = set()
+        chunk = []
+        for row in rows:
+            # Row may be both changed since checkpoint and unsettled
+            if row[0] in folded:
+                continue
+            folded.add(row[0])
+            chunk.append(row)
+            if len(chunk) >= _STATS_CHUNK_SIZE:
+                checkpoint = self._fold_stats_chunk(
+                    chunk, stats, checkpoint_field, checkpoint, stats_ref, loaded_uids, ordered, settled_statuses)
+                chunk = []
+        self._fold_stats_chunk(
+            chunk, stats, checkpoint_field, checkpoint, stats_ref, loaded_uids, True, settled_statuses)
+
+        return stats
+
+    def _fold_stats_chunk(
+        self,
+        chunk: list,
+        stats,
+        checkpoint_field: str,
+        checkpoint,
+        stats_ref,
+        loaded_uids: set,
+        store_checkpoint: bool,
+        settled_statuses: tuple = None):
+        """Fold a chunk of rows into stats and commit rows, users and totals in one batch
+
+        Returns:
+            Any: new high-water mark
+        """
+        rows_ref = stats_ref.collection(u'rows')
+        users_ref = stats_ref.collection(u'users')
+
+        row_refs = [rows_ref.document(hashlib.sha1(path.encode()).hexdigest()) for path, _, _ in chunk]
+        previous = {doc.id: doc.to_dict() for doc in self._db.get_all(row_refs) if doc.exists} if row_refs else {}
+
+        # Load stored totals of users touched for the first time in this run
+        uids = {uid for _, uid, _ in chunk}
+        new_uids = uids - loaded_uids
+        if new_uids:
+            for doc in self._db.get_all([users_ref.document(uid) for uid in new_uids]):
+                stats.load_user(doc.id, doc.to_dict() if doc.exists else {})
+            loaded_uids.update(new_uids)
+
+        batch = self._db.batch()
+        for row_ref, (path, uid, row) in zip(row_refs, chunk):
+            value = row.pop(checkpoint_field, None)
+            if row_ref.id in previous:
+                stats.remove(uid, previous[row_ref.id][u'row'])
+            stats.add(uid, row)
+            folded_row = {u'path': path, u'row': row}
+            if settled_statuses:
+                folded_row[u'unsettled'] = row.get(u'status') not in settled_statuses
+            batch.set(row_ref, folded_row)
+            if value is not None and (checkpoint is None or value > checkpoint):
+                checkpoint = value
+
+        for uid in uids:
+            batch.set(users_ref.document(uid), stats.user_to_dict(uid))
+        batch.set(stats_ref, {
+            u'totals': stats.to_dict(),
+            u'checkpoint': checkpoint if store_checkpoint else None,
+            u'checkpoint_field': checkpoint_field,
+            u'updated_at': int(time.time())
+        })
+        batch.commit()
+        return checkpoint
+
+    def _delete_collection(self, col_ref) -> None:
+        stats = PurgeStats(col_ref.id)
+        while True:
+            docs = list(col_ref.select([]).limit(MAX_BATCH_SIZE).stream())
+            if not docs:
+                return
+            self._commit_deletes([doc.reference for doc in docs], 5, stats)
+
+    def _stream_history_rows(
+        self,
+        collection: str,
+        group_id: str,
+        fields: list,
+        since_field: str = None,
+        since=None):
+        """Stream projected rows of all `{collection}/{uid}/{group_id}` sub-collections
+        with one collection group query.
+
+        Args:
+            since_field (str, optional): field to order rows by, only rows where it is
+                greater than or equal to `since` are returned if given.
+
+        Yields:
+            Tuple[str, str, dict]: path of row, uid owning the row and its projected fields
+        """
+        query = self._db.collection_group(group_id).select(fields)
+        if since_field and since is not None:
+            query = query.where(since_field, u'>=', since).order_by(since_field)
+        yield from self._history_rows(query, collection)
+
+    def _unsettled_history_rows(self, stats_ref, fields: list):
+        """Read again history rows last folded into stats with a status not settled yet
+
+        Yields:
+            Tuple[str, str, dict]: path of row, uid owning the row and its projected fields
+        """
+        query = stats_ref.collection(u'rows').where(u'unsettled', u'==', True).select([u'path'])
+        paths = [doc.to_dict()[u'path'] for doc in query.stream()]
+        for i in range(0, len(paths), MAX_BATCH_SIZE):
+            refs = [self._db.document(path) for path in paths[i:i + MAX_BATCH_SIZE]]
+            for doc in self._db.get_all(refs, field_paths=fields):
+                if doc.exists:
+                    yield doc.reference.path, doc.reference.parent.parent.id, doc.to_dict()
+
+    def _history_rows(self, query, collection: str):
+        prefix = collection + '/'
+        for doc in query.stream():
+            # Same sub-collection name may be used under other root collections
+            if not doc.reference.path.startswith(prefix):
+                continue
+            yield doc.reference.path, doc.reference.parent.parent.id, doc.to_dict()
+
+    def _partition_group(self, group_id: str, fields: list = None) -> list:
+        """Split a collection group into SCAN_PARTITIONS key-range queries, projected to fields
+        """
+        queries = partition_queries(self._db.collection_group(group_id), SCAN_PARTITIONS)
+        return [query.select(fields) for query in queries] if fields else queries
 
-        print('Total number of users to whom interest is paid: {}'.format(total_users))
-        print('Total interest paid out: {} USDS'.format(total_interest_paid))
-        
     
-    def users_with_positive_balance(self) -> None:
-        """list users with positive balances
+    def scan_positive_balances(
+        self,
+        thresholds: Dict[str, float] = None,
+        page_size: int = MAX_BATCH_SIZE) -> Iterator[BalanceRecord]:
+        """Stream users with positive balances from `balances` and `pending_balances`.
+
+        Both collections are split into key-range partitions scanned concurrently, and
+        records are handed over through a bounded queue, so memory use doesn't grow
+        with number of users.
+
+        Args:
+            thresholds (Dict[str, float], optional): Minimum balance by currency, a balance
+                is reported only above it. Defaults to 0 for all currencies.
+            page_size (int, optional): Records buffered before scans wait for consumer. Defaults to 500.
+
+        Yields:
+            BalanceRecord: positive balances of a user
         """
+        thresholds = thresholds or {}
 
-        print("Users with positive balances") 
-        col_ref = self._db.collection("balances")
-        docs = col_ref.stream()
-        
-        for doc in docs:
-            hasBalance = False
-            doc_params = doc.to_dict()
-            msg = 'User: {}'.format(doc.id)
-            for param in doc_params:
-                balance = float("%.4f" % doc_params[param])
-                if balance > 0:
-                    hasBalance = True
-                    msg+= ' {}:{}'.format(param,balance)
-            if  hasBalance: 
-                print(msg)
-                
-        print("\n\nUsers with positive pending balances") 
-        col_ref = self._db.collection("pending_balances")
-        docs = col_ref.stream()
-        
-        for doc in docs:
-            hasBalance = False
-            doc_params = doc.to_dict()
-            msg = 'User: {}'.format(doc.id)         
-            for param in doc_params:
-                balance = float("%.4f" % doc_params[param])
-                if balance > 0:
-                    hasBalance = True
-                    msg+= ' {}:{}'.format(param,balance)
-            if  hasBalance: 
-                print(msg)
\ No newline at end of file
+        def scan(collection: str, query) -> Iterator[BalanceRecord]:
+            for doc in query.stream():
+                # Only documents of root collection, not of sub-collections with same name
+                if doc.reference.parent.parent is not None:
+                    continue
+                balances = {}
+                for currency, value in doc.to_dict().items():
+                    balance = round(value, 4)
+                    if balance > thresholds.get(currency, 0):
+                        balances[currency] = balance
+                if balances:
+                    yield BalanceRecord(collection, doc.id, balances)
+
+        queries = [
+            (collection, query)
+            for collection in ["balances", "pending_balances"]
+            for query in self._partition_group(collection)]
+        yield from stream_partitions(queries, lambda item: scan(*item), SCAN_CONCURRENCY, page_size)
+
+    @traced('firestore.users_with_positive_balance')
+    def users_with_positive_balance(
+        self,
+        fp: TextIO = None,
+        fmt: str = 'text',
+        thresholds: Dict[str, float] = None) -> int:
+        """list users with positive balances
+
+        Args:
+            fp (TextIO, optional): output stream. Defaults to stdout.
+            fmt (str, optional): 'text', 'csv' or 'jsonl'. Defaults to 'text'.
+            thresholds (Dict[str, float], optional): Minimum balance by currency. Defaults to 0.
+
+        Returns:
+            int: number of users listed
+        """
+        return write_balance_records(self.scan_positive_balances(thresholds), fp or sys.stdout, fmt)
@@ -0,0 +1,186 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import datetime
+import threading
+import time
+
+
+@dataclass(frozen=True)
+class Contract:
+    """Future contract listed on exchange"""
+    name: str
+    base_currency: str
+    quote_currency: str
+    expiry: datetime.datetime
+    status: str
+
+
+@dataclass(frozen=True)
+class ResolvedContracts:
+    """Front and next contract of a base currency"""
+    front: Contract
+    next: Optional[Contract] = None
+
+
+class InstrumentCatalog:
+
+    def __init__(
+        self,
+        fetch_symbols: Callable[[], List[dict]],
+        ttl: int = 300,
+        delivery_margin: int = 3600) -> None:
+        """Constructor
+
+        Args:
+            fetch_symbols (Callable[[], List[dict]]): function returning the raw symbol list of exchange
+            ttl (int, optional): seconds after which catalog is refreshed in background. Defaults to 300.
+            delivery_margin (int, optional): seconds before delivery from which a contract is
+                considered expired, so next one is resolved instead. Defaults to 3600.
+        """
+        self._fetch_symbols = fetch_symbols
+        self._ttl = ttl
+        self._delivery_margin = datetime.timedelta(seconds=delivery_margin)
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._loaded_at = 0.0
+        self._index: Dict[Tuple[str, str], List[Contract]] = {}
+
+        # Resolutions by (quote currency, base currencies), with time until which they hold
+        self._resolved: Dict[Tuple[str, Tuple[str, ...]], Tuple[datetime.datetime, Dict[str, ResolvedContracts]]] = {}
+
+    def get_next_symbol_name(self, base_currency: str = 'BTC', quote_currency: str = 'USD') -> str:
+        """Get name of next enabled and non-expired symbol from catalog
+
+        Args:
+            base_currency (str, optional): Base currency. Defaults to 'BTC'.
+            quote_currency (str, optional): Quote currency. Defaults to 'USD'.
+
+        Raises:
+            ValueError: if no enabled and non-expired symbol exists
+
+        Returns:
+            str: Returns the name of next enabled and non-expired symbol
+        """
+        return self.resolve([base_currency], quote_currency)[base_currency].front.name
+
+    def resolve(self, base_currencies: Iterable[str], quote_currency: str = 'USD') -> Dict[str, ResolvedContracts]:
+        """Resolve front and next contract of several base currencies at once
+
+        Resolution is memoized until the front contract of one of the base currencies
+        reaches its delivery margin.
+
+        Args:
+            base_currencies (Iterable[str]): base currencies (eg: ['BTC', 'ETH'])
+            quote_currency (str, optional): Quote currency. Defaults to 'USD'.
+
+        Raises:
+            ValueError: if no enabled and non-expired symbol exists for a base currency
+
+        Returns:
+            Dict[str, ResolvedContracts]: contracts by base currency
+        """
+        if not self._loaded_at:
+            self.refresh()
+        elif time.time() - self._loaded_at > self._ttl:
+            self._refresh_in_background()
+
+        now = datetime.datetime.utcnow()
+        key = (quote_currency, tuple(sorted(set(base_currencies))))
+        resolved = self._resolved.get(key)
+        if resolved is not None and now < resolved[0]:
+            return resolved[1]
+
+        # A contract reached its delivery margin since catalog was loaded, so reload
+        # catalog to pick up newly listed contracts before resolving the next one
+        loaded_at = datetime.datetime.utcfromtimestamp(self._loaded_at)
+        if any(loaded_at < contract.expiry - self._delivery_margin <= now
+               for base_currency in key[1]
+               for contract in self._index.get((base_currency, quote_currency), [])):
+            self.refresh()
+
+        contracts: Dict[str, ResolvedContracts] = {}
+        for base_currency in key[1]:
+            live = [
+                contract for contract in self._index.get((base_currency, quote_currency), [])
+                if contract.status == 'Trading' and contract.expiry - self._delivery_margin > now]
+            if not live:
+                raise ValueError('no enabled future symbol found for %s%s' % (base_currency, quote_currency))
+            contracts[base_currency] = ResolvedContracts(live[0], live[1] if len(live) > 1 else None)
+
+        valid_until = min(resolution.front.expiry for resolution in contracts.values()) - self._delivery_margin
+        with self._lock:
+            self._resolved[key] = (valid_until, contracts)
+        return contracts
+
+    def refresh(self) -> None:
+        """Download symbol list from exchange and rebuild the index
+        """
+        all_symbols = self._fetch_symbols()
+        index = self._build_index(all_symbols)
+        with self._lock:
+            self._index = index
+            self._resolved = {}
+            self._loaded_at = time.time()
+
+    def invalidate(self) -> None:
+        """Drop the catalog so next lookup downloads symbol list again
+        """
+        with self._lock:
+            self._index = {}
+            self._resolved = {}
+            self._loaded_at = 0.0
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print("failed to refresh instrument catalog: %s" % e)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    @staticmethod
+    def _build_index(all_symbols: List[dict]) -> Dict[Tuple[str, str], List[Contract]]:
+        index: Dict[Tuple[str, str], List[Contract]] = {}
+        for symbol in all_symbols:
+            expiry = _parse_expiry(symbol)
+            if expiry is None:
+                continue
+
+            contract = Contract(
+                symbol['name'], symbol['base_currency'], symbol['quote_currency'], expiry, symbol['status'])
+            index.setdefault((contract.base_currency, contract.quote_currency), []).append(contract)
+
+        for contracts in index.values():
+            contracts.sort(key=lambda contract: contract.expiry)
+        return index
+
+
+def _parse_expiry(symbol: dict) -> Optional[datetime.datetime]:
+    # Perpetual symbols (eg: BTCUSD) have no expiry
+    pair = symbol['base_currency'] + symbol['quote_currency']
+    name = symbol['name']
+    if not name.startswith(pair) or len(name) != len(pair) + 3 or not name[-2:].isdigit():
+        return None
+
+    if symbol.get('delivery_time'):
+        try:
+            return datetime.datetime.strptime(symbol['delivery_time'][:19], '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            pass
+
+    # name is like BTCUSDH22 where last 2 digits are year, and alias is like BTCUSD0325
+    # where last 4 digits are month and day of delivery
+    month_day = symbol.get('alias', '')[len(pair):]
+    try:
+        # Bybit delivers inverse futures at 08:00 UTC
+        return datetime.datetime(2000 + int(name[-2:]), int(month_day[:2]), int(month_day[2:]), 8)
+    except ValueError:
+        return None
@@ -1,23 +1,136 @@
 from ftx_client import *
+from admission import AdmissionController, FirestoreSemaphore, LocalSemaphore
 from bybit_client import *
 from secret_manager import *
 from db_records import *
+from balances import parse_thresholds
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from order_coalescer import OrderCoalescer
+from pipeline import Pipeline
+from tracing import entry_point, span
+from transport import is_rate_limited
+import utils
+import asyncio
+import contextlib
+import contextvars
+import hashlib
 import os
-
-# Get secret keys from secret manager and initialize exchange api client
-_BYBIT_IS_TESTNET = get_secret_key("BYBIT_IS_TESTNET")
-_BYBIT_API_KEY = get_secret_key("BYBIT_API_KEY")
-_BYBIT_API_SECRET = get_secret_key("BYBIT_API_SECRET")
-_bybit_client = BybitClient(_BYBIT_API_KEY, _BYBIT_API_SECRET, eval(_BYBIT_IS_TESTNET))
+import threading
+import time
 
 _FTX_API_ENDPOINT = 'https://ftx.com/api/'
-_FTX_API_KEY = get_secret_key("FTX_API_KEY")
-_FTX_API_SECRET = get_secret_key("FTX_API_SECRET")
-_FTX_SUB_ACCOUNT = get_secret_key("FTX_SUB_ACCOUNT")
-_ftx_client = FtxClient(_FTX_API_ENDPOINT, _FTX_API_KEY, _FTX_API_SECRET, _FTX_SUB_ACCOUNT)
+
+# Exchange clients are built on first use, so functions which never touch an
+# exchange (eg: purge_old_market_price) don't pay for secrets or clients
+_clients = {}
+_clients_lock = threading.RLock()
+
+def _get_client(name: str, factory):
+    """Get a client from registry, building it with factory on first use.
+
+    Args:
+        name (str): Name of client in registry
+        factory (Callable): Function building the client
+
+    Returns:
+        Any: client
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+def _create_bybit_client() -> BybitClient:
+    # Get secret keys from secret manager and initialize exchange api client
+    secrets = get_secret_keys(["BYBIT_IS_TESTNET", "BYBIT_API_KEY", "BYBIT_API_SECRET"])
+    return BybitClient(
+        secrets["BYBIT_API_KEY"],
+        secrets["BYBIT_API_SECRET"],
+        eval(secrets["BYBIT_IS_TESTNET"]))
+
+def _create_ftx_client() -> FtxClient:
+    # Get secret keys from secret manager and initialize exchange api client
+    secrets = get_secret_keys(["FTX_API_KEY", "FTX_API_SECRET", "FTX_SUB_ACCOUNT"])
+    return FtxClient(
+        _FTX_API_ENDPOINT,
+        secrets["FTX_API_KEY"],
+        secrets["FTX_API_SECRET"],
+        secrets["FTX_SUB_ACCOUNT"])
+
+def _get_bybit_client() -> BybitClient:
+    return _get_client('bybit', _create_bybit_client)
+
+def _get_ftx_client() -> FtxClient:
+    return _get_client('ftx', _create_ftx_client)
+
+def _get_order_coalescer() -> OrderCoalescer:
+    return _get_client(
+        'bybit_coalescer',
+        lambda: OrderCoalescer(_get_bybit_client().place_order, _ORDER_COALESCE_WINDOW))
 
 STABLE_COINS = ['USDC', 'USDT']
+
+# Exchanges on which a conversion places orders
+ORDER_LEGS = ('bybit', 'ftx')
+
+# Seconds order journal entries are kept, longer than triggers are retried
+_ORDER_JOURNAL_RETENTION = int(os.environ.get('ORDER_JOURNAL_RETENTION', 7 * 86400))
+
+class OrderUnverifiable(Exception):
+    """Raised when an order of a previous attempt may have gone out but can't be looked up"""
+
+_MAX_PURGE_WORKERS = 8
+_MAX_PRICE_WORKERS = int(os.environ.get('MARKET_PRICE_CONCURRENCY', 16))
+_MARKET_PRICE_TIMEOUT = float(os.environ.get('MARKET_PRICE_TIMEOUT', 10))
+_ORDER_STEP_TIMEOUT = float(os.environ.get('ORDER_STEP_TIMEOUT', 10))
+
+# Ratio of minute-level price job runs traced, defaults to TRACE_SAMPLE_RATE
+_PRICE_JOB_TRACE_SAMPLE_RATE = (
+    float(os.environ['PRICE_JOB_TRACE_SAMPLE_RATE']) if 'PRICE_JOB_TRACE_SAMPLE_RATE' in os.environ else None)
+
+# Seconds during which bybit hedge orders are collected and netted per symbol, 0 disables it.
+# Only orders of concurrent requests of the same instance are netted, so it is only useful on
+# runtimes serving several requests per instance (not on gen1 cloud functions). Coalesced orders
+# carry no order_link_id of their requests, so a replayed bybit leg is left for review.
+_ORDER_COALESCE_WINDOW = float(os.environ.get('ORDER_COALESCE_WINDOW', 0))
+
+# Shared by all requests of this instance, so a timed out stage never blocks the next one
+_order_executor = ThreadPoolExecutor(max_workers=8)
+
+# Maximum number of requests placing orders at once, 0 disables admission control. With 'firestore'
+# scope the limit is shared by all instances, with 'local' scope each instance has its own limit
+_ORDER_ADMISSION_LIMIT = int(os.environ.get('ORDER_ADMISSION_LIMIT', 0))
+_ORDER_ADMISSION_SCOPE = os.environ.get('ORDER_ADMISSION_SCOPE', 'firestore')
+if _ORDER_ADMISSION_SCOPE not in ('firestore', 'local'):
+    raise ValueError("ORDER_ADMISSION_SCOPE must be one of ('firestore', 'local')")
+
+# Seconds a request waits for admission before its orders are queued, and seconds
+# after which a slot held by a crashed instance is reclaimed
+_ORDER_ADMISSION_WAIT = float(os.environ.get('ORDER_ADMISSION_WAIT', 20))
+_ORDER_ADMISSION_LEASE = float(os.environ.get('ORDER_ADMISSION_LEASE', 60))
+
+# Times orders rejected by exchange rate limit are queued again before conversion is marked as error
+_ORDER_QUEUE_MAX_ATTEMPTS = int(os.environ.get('ORDER_QUEUE_MAX_ATTEMPTS', 10))
+
+# Queued conversions processed at once by a requeue run, and seconds after which a claimed
+# conversion whose run didn't finish (eg: crashed) is claimed again
+_ORDER_REQUEUE_CONCURRENCY = int(os.environ.get('ORDER_REQUEUE_CONCURRENCY', 8))
+_ORDER_CLAIM_LEASE = int(os.environ.get('ORDER_CLAIM_LEASE', 600))
+
+def _get_admission_controller() -> AdmissionController:
+    def create() -> AdmissionController:
+        if _ORDER_ADMISSION_SCOPE == 'local':
+            return AdmissionController(LocalSemaphore(_ORDER_ADMISSION_LIMIT))
+        return AdmissionController(FirestoreSemaphore(
+            get_firestore_client(), limit=_ORDER_ADMISSION_LIMIT, lease=_ORDER_ADMISSION_LEASE))
+
+    return _get_client('admission', create)
     
+@entry_point()
 def place_order_api(event, context):
     """Place an order on firestore document creation trigger
     Args:
@@ -36,44 +149,17 @@ def place_order_api(event, context):
 
     db_records = DbRecords(resource_string)
 
-    try:
-        result = __place_bybit_future_order(from_currency, to_currency, amount, rate)
-            
-        # Add sub collection document to firestore to record order information
-        db_records.add_convert_history_order_document_on_success(
-            'bybit',
-            result['order_id'], 
-            result['symbol'], 
-            result['side'], 
-            result['qty'], 
-            result['created_at'])
-
-        # Specific usecase for stable coin USDC & USDT
-        if from_currency in STABLE_COINS or to_currency in STABLE_COINS:
-            result = __place_ftx_spot_order(from_currency, to_currency, amount)
-            
-            if result is not None:
-                # Add sub collection document to firestore to record order information
-                db_records.add_convert_history_order_document_on_success(
-                    'ftx',
-                    result['id'], 
-                    result['market'], 
-                    result['side'], 
-                    result['size'], 
-                    result['createdAt'])
-            
-        # Update history document with status 'sent'    
-        db_records.update_convert_history_document("sent")
-
-    except Exception as e:
-        print(str(e))
-       
-        # Add sub collection document to firestore to record failure information
-        db_records.add_convert_history_order_document_on_failure(str(e))
+    # Orders are journaled before they go out, so a retried trigger can't place them twice
+    history = db_records.begin_order_journal()
+    replay = history is not None
+    if replay and history.get('status', 'pending') != 'pending':
+        print("history document is already '%s', ignoring replayed trigger" % history['status'])
+        return
 
-        # Update history document with status 'error' 
-        db_records.update_convert_history_document("error")
+    __process_order(
+        db_records, resource_string, ORDER_LEGS if replay else (), from_currency, to_currency, amount, rate)
         
+@entry_point(_PRICE_JOB_TRACE_SAMPLE_RATE)
 def update_market_price(event, context):
     """Update price history for target markets using ftx api
 
@@ -84,26 +170,44 @@ def update_market_price(event, context):
     try:
         target_markets = os.environ["TARGET_MARKETS"]
         db_records = DbRecords()
-        
-        for target_market in target_markets.split('|'):
+        ftx_client = _get_ftx_client()
+
+        # Fetch prices of all markets concurrently, each within its deadline
+        markets = [target_market.strip() for target_market in target_markets.split('|')]
+        executor = ThreadPoolExecutor(max_workers=min(len(markets), _MAX_PRICE_WORKERS))
+        futures = {
+            market: executor.submit(contextvars.copy_context().run, __get_market_price, ftx_client, market)
+            for market in markets}
+        deadline = time.time() + _MARKET_PRICE_TIMEOUT
+
+        prices = []
+        for market, future in futures.items():
             try:
-                market = target_market.strip()
-                price = _ftx_client.get_single_market_price(market)
+                price = future.result(timeout=max(deadline - time.time(), 0))
                 if price <= 0:
                     print("price is less than zero for target market '%s'" % market)
                 else:
-                    currency_pair = "{0}-USD".format(target_market.split('-')[0])
-                    
-                    # Add latest market price in table
-                    db_records.add_price_history_document(currency_pair, price, market)
+                    currency_pair = "{0}-USD".format(market.split('-')[0])
+                    prices.append((currency_pair, price, market))
+            except TimeoutError:
+                print("timed out getting price for target market '%s'" % market)
             except Exception as e:
                 print(e)
-                pass
+
+        # Don't wait for markets which missed their deadline
+        executor.shutdown(wait=False)
+
+        # Add latest market prices in table with a single batched write
+        with db_records.batch():
+            for currency_pair, price, market in prices:
+                db_records.add_price_history_document(currency_pair, price, market)
     except Exception as e:
         print(e)
         
+@entry_point()
 def purge_old_market_price(event, context):
-    """Purge/delete old price histories (older than 3 days) for target markets
+    """Purge/delete old price histories (older than 3 days) for target markets, and order
+    journal entries older than ORDER_JOURNAL_RETENTION
 
     Args:
          event (dict): Event payload.
@@ -112,8 +216,8 @@ def purge_old_market_price(event, context):
     try:
         target_markets = os.environ["TARGET_MARKETS"]
         db_records = DbRecords()
-        
-        for target_market in target_markets.split('|'):
+
+        def purge(target_market: str) -> None:
             try:
                 market = target_market.strip()
                 
@@ -122,42 +226,359 @@ def purge_old_market_price(event, context):
                     
                 # Delete old prices from table added 3 days before.
                 print("start purging old data for target market '%s'" % market)
-                db_records.delete_old_price_history_documents(currency_pair)
-                print("finished purging old data for target market '%s'" % market)
+                stats = db_records.delete_old_price_history_documents(currency_pair)
+                print("finished purging old data for target market '%s': %s" % (market, stats))
             except Exception as e:
-                print(e)
-                pass
+                # Other markets are still purged, eg: if an index of this one is missing
+                print("failed purging old data for target market '%s': %r" % (target_market.strip(), e))
+
+        # Markets are purged concurrently, each one in batches
+        markets = target_markets.split('|')
+        with ThreadPoolExecutor(max_workers=min(len(markets), _MAX_PURGE_WORKERS)) as executor:
+            list(executor.map(lambda market: contextvars.copy_context().run(purge, market), markets))
+
+        # Order journal entries are only needed while triggers may be retried
+        print("finished purging order journal: %s" % db_records.delete_old_order_journal_documents(
+            _ORDER_JOURNAL_RETENTION))
     except Exception as e:
         print(e)
         
+@entry_point()
 def calculate_stats(event, context):
     """Calculate stats
 
+    By default only rows added or changed since last run are folded into stats stored
+    in firestore. Mode can be overridden by `mode` attribute of pub/sub message or
+    `STATS_MODE` environment variable:
+        - incremental: fold new and changed rows into stored stats
+        - rebuild: rebuild stored stats from all rows
+        - full: compute stats from all rows without storing them
+
+    Args:
+         event (dict): Event payload.
+         context (google.cloud.functions.Context): Metadata for the event.
     """
+    attributes = (event or {}).get('attributes') or {}
+    mode = attributes.get('mode', os.environ.get('STATS_MODE', 'incremental'))
+
     db_records = DbRecords()
-    db_records.calculate_conversions_stats()
-    db_records.calculate_total_paid_interest()
+    if mode == 'full':
+        db_records.calculate_conversions_stats()
+        db_records.calculate_total_paid_interest()
+    else:
+        full_rebuild = mode == 'rebuild'
+        db_records.materialize_conversions_stats(full_rebuild)
+        db_records.materialize_interest_stats(full_rebuild)
+
+@entry_point()
+def requeue_queued_orders(event, context):
+    """Place orders of conversions queued by `conversion_request_place_order_api`, because
+    no admission slot was free in time or exchange rate limit was exceeded
+
+    Args:
+         event (dict): Event payload.
+         context (google.cloud.functions.Context): Metadata for the event.
+    """
+    try:
+        queued = DbRecords().queued_convert_histories(_ORDER_CLAIM_LEASE)
+        print("found %s queued conversions" % len(queued))
+
+        def requeue(snapshot) -> None:
+            try:
+                fields = snapshot.to_dict()
+                resource_string = 'projects/%s/databases/(default)/documents/%s' % (
+                    utils.get_project_id(), snapshot.reference.path)
+                db_records = DbRecords(resource_string)
+                if not db_records.claim_queued_order(snapshot.update_time):
+                    print("queued conversion '%s' is claimed by another run" % snapshot.reference.path)
+                    return
+
+                # Queued legs didn't go out, but a bybit order is looked up by its order_link_id
+                # first, unless coalesced orders carry none. If a previous claim expired, its
+                # run may have placed any leg before it died.
+                expired_claim = fields.get('status') == 'claimed'
+                if expired_claim:
+                    print("claim of conversion '%s' expired, replaying it" % snapshot.reference.path)
+                    replay_legs = ORDER_LEGS
+                else:
+                    replay_legs = () if _ORDER_COALESCE_WINDOW > 0 else ('bybit',)
+                __process_order(
+                    db_records,
+                    resource_string,
+                    replay_legs,
+                    fields['from_currency'],
+                    fields['to_currency'],
+                    float(fields['amount']),
+                    float(fields['rate']),
+                    fields.get('attempts', 0),
+                    tuple(fields.get('queued_legs', ORDER_LEGS)))
+            except Exception as e:
+                print(e)
 
+        # Oldest queued first, and largest first among those waiting for admission
+        with ThreadPoolExecutor(max_workers=max(min(len(queued), _ORDER_REQUEUE_CONCURRENCY), 1)) as executor:
+            list(executor.map(lambda snapshot: contextvars.copy_context().run(requeue, snapshot), queued))
+    except Exception as e:
+        print(e)
+
+@entry_point()
 def list_user_with_positive_balance(event, context):
     """List users
 
     """
     db_records = DbRecords()
-    db_records.users_with_positive_balance()
+    db_records.users_with_positive_balance(
+        fmt=os.environ.get('BALANCE_EXPORT_FORMAT', 'text'),
+        thresholds=parse_thresholds(os.environ.get('BALANCE_THRESHOLDS')))
 
-# In ftx, amount & side is w.r.t BTC        
-def __place_ftx_spot_order(
+def __process_order(
+    db_records: DbRecords,
+    resource_string: str,
+    replay_legs: tuple,
     from_currency: str,
     to_currency: str,
-    amount: float) -> dict:
-    
-    # do nothing if conversion is not for stable coin
-    if from_currency not in STABLE_COINS and to_currency not in STABLE_COINS:
+    amount: float,
+    rate: float,
+    attempts: int = 0,
+    legs: tuple = ORDER_LEGS) -> None:
+    """Place orders of a conversion once admitted, and record result in its history document.
+
+    Orders are queued instead when no admission slot is free in time, and legs rejected
+    by exchange because rate limit was exceeded are queued once other legs are recorded.
+
+    Args:
+        replay_legs (tuple): legs whose order may have gone out in a previous attempt
+        attempts (int, optional): attempts rejected by exchange rate limit so far. Defaults to 0.
+        legs (tuple, optional): legs to place. Defaults to ORDER_LEGS.
+    """
+    pipeline = Pipeline(_order_executor, _ORDER_STEP_TIMEOUT)
+    _, _, qty = __plan_bybit_future_order(from_currency, to_currency, amount, rate)
+
+    if replay_legs:
+        # Orders recorded by a previous attempt are not placed again
+        recorded = db_records.recorded_order_exchanges()
+        legs = tuple(leg for leg in legs if leg not in recorded)
+
+    # Largest orders are admitted first
+    with __admit(pipeline, qty) as admitted:
+        if not admitted:
+            print("no admission slot within %ss, queueing orders" % _ORDER_ADMISSION_WAIT)
+            db_records.queue_convert_history_document(
+                attempts, legs, 'no admission slot within %ss' % _ORDER_ADMISSION_WAIT, pipeline.breakdown())
+            return
+
+        # All order documents and final status are committed together in one batch,
+        # so a partial failure can't leave orphan order documents under a pending history
+        with db_records.batch():
+            bybit_result = ftx_result = None
+            try:
+                bybit_result, ftx_result = asyncio.run(__execute_orders(
+                    pipeline, resource_string, replay_legs, from_currency, to_currency, amount, rate, legs))
+
+                # Record every leg which went out, even if the other one failed
+                if bybit_result is not None and not isinstance(bybit_result, Exception):
+                    # Add sub collection document to firestore to record order information
+                    db_records.add_convert_history_order_document_on_success(
+                        'bybit',
+                        bybit_result['order_id'], 
+                        bybit_result['symbol'], 
+                        bybit_result['side'], 
+                        bybit_result['qty'], 
+                        bybit_result['created_at'])
+
+                if ftx_result is not None and not isinstance(ftx_result, Exception):
+                    # Add sub collection document to firestore to record order information
+                    db_records.add_convert_history_order_document_on_success(
+                        'ftx',
+                        ftx_result['id'], 
+                        ftx_result['market'], 
+                        ftx_result['side'], 
+                        ftx_result['size'], 
+                        ftx_result['createdAt'])
+
+                # Legs rejected by rate limit had no effect, so they are placed again later
+                # instead of failing conversion
+                throttled = __throttled_legs(bybit_result, ftx_result)
+                if throttled and attempts < _ORDER_QUEUE_MAX_ATTEMPTS:
+                    print("%s order rejected by exchange rate limit, queueing it (attempt %s)" % (
+                        '/'.join(throttled), attempts + 1))
+                    db_records.queue_convert_history_document(
+                        attempts + 1, tuple(throttled), '; '.join(str(e) for e in throttled.values()),
+                        pipeline.breakdown())
+                    return
+
+                for result in (bybit_result, ftx_result):
+                    if isinstance(result, Exception):
+                        raise result
+            
+                # Update history document with status 'sent'    
+                db_records.update_convert_history_document("sent", pipeline.breakdown())
+
+            except Exception as e:
+                print(str(e))
+       
+                # Add sub collection document to firestore to record failure information
+                db_records.add_convert_history_order_document_on_failure(str(e))
+
+                # Update history document with status 'review' if an order went out (eg: ftx order
+                # while bybit order failed) or may have gone out unrecorded, as neither conversion_batch
+                # nor a replay follows up an 'error'. Otherwise with status 'error'
+                results = (bybit_result, ftx_result)
+                placed = any(result is not None and not isinstance(result, Exception) for result in results)
+                unverifiable = any(isinstance(result, OrderUnverifiable) for result in results)
+                db_records.update_convert_history_document(
+                    "review" if placed or unverifiable else "error", pipeline.breakdown())
+
+    print("order pipeline latency (ms): %s" % pipeline.breakdown())
+    # Hits and misses since this instance started
+    print("price cache: %s" % latest_prices.stats())
+
+@contextlib.contextmanager
+def __admit(pipeline: Pipeline, priority: float):
+    if _ORDER_ADMISSION_LIMIT <= 0:
+        yield True
         return
-    
-    db_records = DbRecords()
-    rate = db_records.get_market_price('BTC-USD')
-    print("rate for market=BTC-USD is %s" % (rate))
+
+    started = time.time()
+    with _get_admission_controller().admit(priority, _ORDER_ADMISSION_WAIT) as admitted:
+        pipeline.latency['admission'] = round((time.time() - started) * 1000, 1)
+        yield admitted
+
+def __throttled_legs(bybit_result, ftx_result) -> dict:
+    # Failed legs by name, if all of them failed on rate limit
+    failed = {
+        leg: result for leg, result in zip(ORDER_LEGS, (bybit_result, ftx_result)) if isinstance(result, Exception)}
+    return failed if all(is_rate_limited(e) for e in failed.values()) else {}
+
+async def __execute_orders(
+    pipeline: Pipeline,
+    resource_string: str,
+    replay_legs: tuple,
+    from_currency: str,
+    to_currency: str,
+    amount: float,
+    rate: float,
+    legs: tuple = ORDER_LEGS) -> list:
+    """Place bybit future order and, for stable coins, ftx spot order concurrently.
+
+    Symbol resolution and btc price lookup don't depend on each other, and both legs
+    go out together once their inputs are known.
+
+    Bybit order gets an order_link_id derived from the history document, so when the
+    trigger is replayed, an order placed by a previous attempt is found and not placed again.
+
+    Args:
+        replay_legs (tuple): legs whose order may have gone out in a previous attempt
+        legs (tuple, optional): legs to place, others are skipped (eg: placed by a previous attempt).
+            Defaults to ORDER_LEGS.
+
+    Returns:
+        list: result of bybit and ftx legs, an exception if a leg failed or None if there is no ftx leg
+            or leg is skipped
+    """
+
+    async def bybit_leg() -> dict:
+        if 'bybit' not in legs:
+            return None
+
+        base_currency, side, qty = __plan_bybit_future_order(from_currency, to_currency, amount, rate)
+
+        order_link_id = __order_link_id(resource_string, 'bybit')
+        if 'bybit' in replay_legs:
+            if _ORDER_COALESCE_WINDOW > 0:
+                # Coalesced orders carry no id of their own requests
+                raise OrderUnverifiable("bybit order of previous attempt can't be verified, check bybit")
+
+            print("Bybit api call: looking for order of previous attempt with order_link_id=%s" % order_link_id)
+            try:
+                result = await pipeline.run(
+                    'bybit_lookup', lambda: __find_bybit_order(resource_string, base_currency, order_link_id))
+            except Exception as e:
+                # A throttled lookup is queued and made again. Otherwise order of previous attempt
+                # may be live, so conversion is left for review instead of being marked 'error'
+                if is_rate_limited(e):
+                    raise
+                raise OrderUnverifiable(
+                    "bybit order of previous attempt couldn't be looked up (%r), check bybit" % e) from e
+            if result is not None:
+                print(result)
+                return result
+
+        # Api call for getting next symbol name
+        print("Bybit api call: getting next future symbol name for '%sUSD'" % base_currency)
+        symbol = await pipeline.run(
+            'bybit_symbol', lambda: _get_bybit_client().get_next_symbol_name(base_currency))
+
+        # Symbol is journaled first, so a replay finds the order even after symbol rolled
+        await pipeline.run(
+            'bybit_journal', lambda: DbRecords(resource_string).journal_order_symbol('bybit', symbol))
+
+        # Api call for placing future order
+        print("Bybit api call: placing bybit future order for symbol=%s, side=%s, qty=%s" % (symbol, side, qty))
+        if _ORDER_COALESCE_WINDOW > 0:
+            result = await pipeline.run(
+                'bybit_order', lambda: _get_order_coalescer().submit(symbol, side, qty).result(), bounded=False)
+        else:
+            result = await pipeline.run(
+                'bybit_order',
+                lambda: _get_bybit_client().place_order(symbol, side, qty, order_link_id=order_link_id),
+                bounded=False)
+        print(result)
+        return result
+
+    async def ftx_leg() -> dict:
+        # do nothing if conversion is not for stable coin
+        if from_currency not in STABLE_COINS and to_currency not in STABLE_COINS or 'ftx' not in legs:
+            return None
+
+        if 'ftx' in replay_legs:
+            # Ftx client sets no id of ours on orders, so an order of previous attempt can't be found
+            raise OrderUnverifiable("ftx order of previous attempt can't be verified, check ftx")
+
+        btc_rate = await pipeline.run('ftx_price', lambda: DbRecords().get_market_price('BTC-USD'))
+        print("rate for market=BTC-USD is %s" % (btc_rate))
+        market, side, size = __plan_ftx_spot_order(from_currency, to_currency, amount, btc_rate)
+
+        # Api call for placing spot order
+        print("FTX api call: placing ftx spot order for market=%s, side=%s, qty=%s" % (market, side, size))
+        result = await pipeline.run('ftx_order', lambda: __place_ftx_order(market, side, size), bounded=False)
+        print(result)
+        return result
+
+    return await asyncio.gather(bybit_leg(), ftx_leg(), return_exceptions=True)
+
+def __order_link_id(resource_string: str, exchange: str) -> str:
+    # Same history document always gets same id, within bybit's limit of 36 characters
+    path = resource_string.split('/documents/')[-1]
+    return 'cv' + hashlib.sha1((path + '#' + exchange).encode()).hexdigest()[:32]
+
+def __find_bybit_order(resource_string: str, base_currency: str, order_link_id: str) -> dict:
+    # Symbol may have rolled since previous attempt, so journaled symbol is looked up first,
+    # then current contracts for attempts journaled without symbol
+    client = _get_bybit_client()
+    contracts = client.resolve_contracts([base_currency])[base_currency]
+    symbols = [DbRecords(resource_string).journaled_order_symbol('bybit')]
+    symbols += [contract.name for contract in (contracts.front, contracts.next) if contract is not None]
+    for symbol in dict.fromkeys(symbol for symbol in symbols if symbol):
+        order = client.find_order(symbol, order_link_id)
+        if order is not None:
+            return order
+    return None
+
+def __place_ftx_order(market: str, side: str, size: float) -> dict:
+    with span('ftx.place_order', market=market):
+        return _get_ftx_client().place_order(market, side, size)
+
+def __get_market_price(ftx_client, market: str) -> float:
+    with span('ftx.get_single_market_price', market=market):
+        return ftx_client.get_single_market_price(market)
+
+# In ftx, amount & side is w.r.t BTC        
+def __plan_ftx_spot_order(
+    from_currency: str,
+    to_currency: str,
+    amount: float,
+    rate: float) -> tuple:
     
     if to_currency in STABLE_COINS:
         side = 'sell'
@@ -168,19 +589,14 @@ def __place_ftx_spot_order(
    
     # As we don't have market for BTC/USDC, lets use BTC/USD
     market = 'BTC/USD' if (from_currency == 'USDC' or to_currency == 'USDC') else 'BTC/USDT'
-
-    # Api call for placing spot order
-    print("FTX api call: placing ftx spot order for market=%s, side=%s, qty=%s" % (market, side, size))
-    result = _ftx_client.place_order(market, side, size)
-    print(result)
-    return result
+    return market, side, size
 
 # in bybit amount is always in USD & side is w.r.t BTC or ETH
-def __place_bybit_future_order(
+def __plan_bybit_future_order(
     from_currency: str,
     to_currency: str,
     amount: float,
-    rate: float) -> dict:
+    rate: float) -> tuple:
     
     if to_currency == 'USDS':
         base_currency = 'BTC' if from_currency in STABLE_COINS else from_currency
@@ -191,13 +607,4 @@ def __place_bybit_future_order(
         side = 'Buy'
         qty = int(amount)
 
-    # Api call for getting next symbol name
-    print("Bybit api call: getting next future symbol name for '%sUSD'" % base_currency)
-    symbol = _bybit_client.get_next_symbol_name(base_currency)
-    
-    # Api call for placing future order
-    print("Bybit api call: placing bybit future order for symbol=%s, side=%s, qty=%s" % (symbol, side, qty))
-    result = _bybit_client.place_order(symbol, side, qty)
-    print(result)
-    return result
-    
\ No newline at end of file
+    return base_currency, side, qty
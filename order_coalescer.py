@@ -0,0 +1,86 @@
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Tuple
+import datetime
+import threading
+
+# Order id recorded for requests fully offset by opposite requests of the same window
+NETTED_ORDER_ID = 'netted'
+
+
+class OrderCoalescer:
+
+    def __init__(self, place_order: Callable[[str, str, int], dict], window: float = 0.2) -> None:
+        """Constructor
+
+        Args:
+            place_order (Callable[[str, str, int], dict]): function placing an order for symbol, side and qty
+            window (float, optional): seconds during which orders are collected before being placed. Defaults to 0.2.
+        """
+        self._place_order = place_order
+        self._window = window
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, str, int, Future]] = []
+        self._timer = None
+
+    def submit(self, symbol: str, side: str, qty: int) -> Future:
+        """Queue an order to be placed with the other orders of current window
+
+        Args:
+            symbol (str): name of symbol (eg:BTCUSD)
+            side (str): 'Buy' or 'Sell'
+            qty (int): qty/size of order
+
+        Returns:
+            Future: resolves to the order of this request, shaped like the exchange order
+                but with this request's side and qty
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((symbol, side.title(), qty, future))
+            if self._timer is None:
+                self._timer = threading.Timer(self._window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def flush(self) -> None:
+        """Net buy against sell orders of each symbol and place one order per symbol
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._timer = None
+
+        by_symbol: Dict[str, List[Tuple[str, int, Future]]] = {}
+        for symbol, side, qty, future in pending:
+            by_symbol.setdefault(symbol, []).append((side, qty, future))
+
+        for symbol, orders in by_symbol.items():
+            self._place_netted_order(symbol, orders)
+
+    def _place_netted_order(self, symbol: str, orders: List[Tuple[str, int, Future]]) -> None:
+        net_qty = sum(qty if side == 'Buy' else -qty for side, qty, _ in orders)
+        try:
+            if net_qty == 0:
+                order_id = NETTED_ORDER_ID
+                created_at = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            else:
+                net_side = 'Buy' if net_qty > 0 else 'Sell'
+                print("placing coalesced order for symbol=%s, side=%s, qty=%s from %s requests" % (
+                    symbol, net_side, abs(net_qty), len(orders)))
+                result = self._place_order(symbol, net_side, abs(net_qty))
+                order_id = result['order_id']
+                created_at = result['created_at']
+        except Exception as e:
+            # Netted requests rely on each other, so all requests of symbol fail together
+            for _, _, future in orders:
+                future.set_exception(e)
+            return
+
+        for side, qty, future in orders:
+            future.set_result({
+                'order_id': order_id,
+                'symbol': symbol,
+                'side': side,
+                'qty': qty,
+                'created_at': created_at
+            })
@@ -0,0 +1,61 @@
+from concurrent.futures import Executor
+from typing import Callable, Dict
+import asyncio
+import contextvars
+import time
+
+
+class Pipeline:
+
+    def __init__(self, executor: Executor, timeout: float = 10) -> None:
+        """Constructor
+
+        Args:
+            executor (Executor): executor running blocking stages
+            timeout (float, optional): default timeout of a stage in seconds. Defaults to 10.
+        """
+        self._executor = executor
+        self._timeout = timeout
+        self._started = time.time()
+        self.latency: Dict[str, float] = {}
+
+    async def run(self, name: str, func: Callable, timeout: float = None, bounded: bool = True):
+        """Run a blocking stage in executor and record its latency
+
+        Args:
+            name (str): name of stage, used as key of latency breakdown
+            func (Callable): blocking function called without arguments
+            timeout (float, optional): timeout of stage in seconds. Defaults to pipeline's timeout.
+            bounded (bool, optional): apply timeout. Stages with side effects (eg: placing an order)
+                must not be bounded, as func keeps running in executor after a timeout, so its
+                outcome would be unknown. Defaults to True.
+
+        Raises:
+            TimeoutError: if a bounded stage doesn't finish in time
+
+        Returns:
+            Any: result of func
+        """
+        loop = asyncio.get_event_loop()
+        started = time.time()
+        try:
+            # Stage sees the active trace span of the pipeline
+            context = contextvars.copy_context()
+            future = loop.run_in_executor(self._executor, context.run, func)
+            if not bounded:
+                return await future
+            return await asyncio.wait_for(future, self._timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("stage '%s' timed out" % name)
+        finally:
+            self.latency[name] = round((time.time() - started) * 1000, 1)
+
+    def breakdown(self) -> Dict[str, float]:
+        """Get latency of each stage and of whole pipeline so far, in milliseconds
+
+        Returns:
+            Dict[str, float]: latency by stage name
+        """
+        latency = dict(self.latency)
+        latency['total'] = round((time.time() - self._started) * 1000, 1)
+        return latency
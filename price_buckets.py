@@ -0,0 +1,55 @@
+import datetime
+
+# Storage modes of price history: one document per price, or one bucket per market per hour
+STORAGE_MODES = ('documents', 'buckets')
+
+# Length of a bucket, in seconds
+BUCKET_SECONDS = 3600
+
+
+def bucket_start(timestamp: int) -> int:
+    """Get start of the hourly bucket containing a timestamp
+
+    Args:
+        timestamp (int): unix time
+
+    Returns:
+        int: unix time of start of bucket
+    """
+    return int(timestamp) - int(timestamp) % BUCKET_SECONDS
+
+
+def bucket_id(currency_pair: str, timestamp: int) -> str:
+    """Get id of the bucket document holding prices of a currency pair at a timestamp
+
+    Args:
+        currency_pair (str): curreny pair (eg: BTC-USD)
+        timestamp (int): unix time
+
+    Returns:
+        str: document id (eg: BTC-USD_2021050314)
+    """
+    hour = datetime.datetime.utcfromtimestamp(bucket_start(timestamp))
+    return '{0}_{1}'.format(currency_pair, hour.strftime('%Y%m%d%H'))
+
+
+def add_price(timestamp: int, rate: float) -> dict:
+    """Get fields adding a minute price to its bucket, to be merged into the bucket
+    document without reading it first. Nested `prices` map is merged field by field,
+    so prices of other minutes are kept.
+
+    Args:
+        timestamp (int): unix time of price
+        rate (float): market price
+
+    Returns:
+        dict: fields to merge into the bucket document
+    """
+    offset = int(timestamp) - bucket_start(timestamp)
+    return {
+        'start': bucket_start(timestamp),
+        'rate': rate,
+        'timestamp': int(timestamp),
+        'prices': {'%02d' % (offset // 60): rate},
+    }
+
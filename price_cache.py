@@ -0,0 +1,79 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class PriceCache:
+
+    def __init__(self, max_age: float = 50) -> None:
+        """Constructor
+
+        Args:
+            max_age (float, optional): seconds after which a cached price is stale. Defaults to 50.
+        """
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.last_served_age: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._prices: Dict[str, Tuple[float, float]] = {}
+
+    def put(self, currency_pair: str, rate: float, timestamp: float) -> None:
+        """Store price of a currency pair unless a newer one is already cached
+
+        Args:
+            currency_pair (str): curreny pair (eg: BTC-USD)
+            rate (float): market price
+            timestamp (float): unix time at which price was recorded
+        """
+        with self._lock:
+            cached = self._prices.get(currency_pair)
+            if cached is None or cached[1] <= timestamp:
+                self._prices[currency_pair] = (rate, timestamp)
+
+    def get(self, currency_pair: str, max_age: Optional[float] = None) -> Optional[float]:
+        """Get cached price of a currency pair if it is fresh enough
+
+        Args:
+            currency_pair (str): curreny pair (eg: BTC-USD)
+            max_age (Optional[float], optional): staleness bound overriding the default one.
+
+        Returns:
+            Optional[float]: market price, None on miss or if cached price is stale
+        """
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            cached = self._prices.get(currency_pair)
+            if cached is not None:
+                age = time.time() - cached[1]
+                if age <= max_age:
+                    self.hits += 1
+                    self.last_served_age[currency_pair] = age
+                    return cached[0]
+            self.misses += 1
+            return None
+
+    def invalidate(self, currency_pair: str = None) -> None:
+        """Drop cached price of a currency pair, or all prices
+
+        Args:
+            currency_pair (str, optional): curreny pair (eg: BTC-USD). Defaults to all.
+        """
+        with self._lock:
+            if currency_pair is None:
+                self._prices.clear()
+            else:
+                self._prices.pop(currency_pair, None)
+
+    def stats(self) -> dict:
+        """Get cache hits, misses and age of last served price per currency pair
+
+        Returns:
+            dict: cache statistics
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'last_served_age': dict(self.last_served_age)
+            }
@@ -0,0 +1,228 @@
+"""Long-running price ingestor streaming bybit tickers into price history.
+
+Unlike `update_market_price`, which polls a REST api once a minute, it keeps the latest
+price of each target market in memory as soon as bybit publishes it, and writes to price
+history only when the price moved significantly or a heartbeat interval elapsed.
+
+It is meant to run as a single long-lived process (eg: on cloud run or a vm), not as a
+cloud function:
+    TARGET_MARKETS='BTC-PERP|ETH-PERP' python price_ingestor.py
+"""
+from bybit_client import BybitClient
+from concurrent.futures import ThreadPoolExecutor
+from db_records import DbRecords, latest_prices
+from secret_manager import get_secret_keys
+from typing import Callable, Dict, Optional, Tuple
+import json
+import os
+import threading
+import time
+import websocket
+
+BYBIT_WS_URL = 'wss://stream.bybit.com/realtime'
+BYBIT_TESTNET_WS_URL = 'wss://stream-testnet.bybit.com/realtime'
+
+# Bybit closes connections not pinged within a minute
+_PING_INTERVAL = 20
+
+
+class PriceThrottle:
+
+    def __init__(self, min_change: float = 0.0005, min_interval: float = 5, max_interval: float = 60) -> None:
+        """Decide which streamed prices are written to price history
+
+        Args:
+            min_change (float, optional): relative change from last written price worth writing. Defaults to 0.0005.
+            min_interval (float, optional): minimum seconds between writes of a currency pair. Defaults to 5.
+            max_interval (float, optional): seconds after which an unchanged price is written again,
+                so that readers can tell the feed is alive. Defaults to 60.
+        """
+        self.min_change = min_change
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._written: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def should_write(self, currency_pair: str, rate: float, now: float = None) -> bool:
+        """Check whether a price is written, and if so count it as written
+
+        Args:
+            currency_pair (str): curreny pair (eg: BTC-USD)
+            rate (float): latest price
+            now (float, optional): unix time. Defaults to current time.
+
+        Returns:
+            bool: True if price must be written
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            written = self._written.get(currency_pair)
+            if written is not None:
+                written_rate, written_at = written
+                elapsed = now - written_at
+                changed = abs(rate - written_rate) >= self.min_change * written_rate
+                if elapsed < self.max_interval and not (changed and elapsed >= self.min_interval):
+                    return False
+            self._written[currency_pair] = (rate, now)
+            return True
+
+
+class PriceIngestor:
+
+    def __init__(
+        self,
+        bybit_client: BybitClient,
+        target_markets: list,
+        url: str = BYBIT_WS_URL,
+        throttle: PriceThrottle = None,
+        resolve_interval: float = 3600,
+        write: Callable[[str, float, str], None] = None) -> None:
+        """Constructor
+
+        Args:
+            bybit_client (BybitClient): client resolving the symbol of each target market
+            target_markets (list): markets whose base currency is streamed (eg: ['BTC-PERP', 'ETH-PERP'])
+            url (str, optional): bybit public websocket url. Defaults to mainnet.
+            throttle (PriceThrottle, optional): write throttle. Defaults to `PriceThrottle()`.
+            resolve_interval (float, optional): seconds after which symbols are resolved again,
+                to follow the next contract after expiry. Defaults to 3600.
+            write (Callable[[str, float, str], None], optional): writer of (currency_pair, rate, symbol).
+                Defaults to adding a price history document.
+        """
+        self._bybit_client = bybit_client
+        self._base_currencies = sorted({market.strip().split('-')[0] for market in target_markets})
+        self._url = url
+        self._throttle = throttle or PriceThrottle()
+        self._resolve_interval = resolve_interval
+        self._write = write or (lambda currency_pair, rate, symbol: DbRecords().add_price_history_document(
+            currency_pair, rate, symbol, source='BYBIT'))
+
+        # Writes don't block the socket, and are applied in order
+        self._writer = ThreadPoolExecutor(max_workers=1)
+        self._symbols: Dict[str, str] = {}
+        self._resolved = 0.0
+        self._ws: Optional[websocket.WebSocketApp] = None
+        self._stopped = threading.Event()
+        self.received = 0
+        self.written = 0
+
+    def resolve_symbols(self) -> Dict[str, str]:
+        """Resolve the symbol streamed for each base currency
+
+        Returns:
+            Dict[str, str]: currency pair (eg: BTC-USD) by symbol (eg: BTCUSDZ21)
+        """
+        contracts = self._bybit_client.resolve_contracts(self._base_currencies)
+        symbols = {
+            resolved.front.name: '{0}-USD'.format(base_currency) for base_currency, resolved in contracts.items()}
+        self._symbols = symbols
+        self._resolved = time.time()
+        return symbols
+
+    def run(self) -> None:
+        """Stream prices until `stop` is called, reconnecting with backoff on failure"""
+        backoff = 1
+        while not self._stopped.is_set():
+            started = time.time()
+            self.resolve_symbols()
+            self._ws = websocket.WebSocketApp(
+                self._url,
+                on_open=self._on_open,
+                on_message=lambda ws, message: self.on_message(message),
+                on_error=lambda ws, error: print("price ingestor error: %s" % error))
+            self._ws.run_forever()
+
+            if self._stopped.is_set():
+                break
+            # Connection dropped, or was closed to follow new symbols
+            backoff = 1 if time.time() - started > 60 else min(backoff * 2, 60)
+            time.sleep(backoff if time.time() - self._resolved < self._resolve_interval else 0)
+        self._writer.shutdown(wait=True)
+
+    def stop(self) -> None:
+        """Stop streaming"""
+        self._stopped.set()
+        if self._ws is not None:
+            self._ws.close()
+
+    def on_message(self, message: str) -> None:
+        """Handle a websocket message, keeping latest price in memory and writing it if needed
+
+        Args:
+            message (str): json message
+        """
+        data = json.loads(message)
+        if not data.get('topic', '').startswith('instrument_info.'):
+            return
+
+        for ticker in _tickers(data):
+            symbol = ticker.get('symbol')
+            rate = _last_price(ticker)
+            currency_pair = self._symbols.get(symbol)
+            if currency_pair is None or not rate:
+                continue
+
+            self.received += 1
+            now = time.time()
+            latest_prices.put(currency_pair, rate, now)
+            if self._throttle.should_write(currency_pair, rate, now):
+                self.written += 1
+                self._writer.submit(self._safe_write, currency_pair, rate, symbol)
+
+        # Reconnect to follow the next contract, once symbols are due to be resolved again
+        if time.time() - self._resolved >= self._resolve_interval and self._ws is not None:
+            self._ws.close()
+
+    def _on_open(self, ws) -> None:
+        ws.send(json.dumps({
+            'op': 'subscribe',
+            'args': ['instrument_info.100ms.' + symbol for symbol in self._symbols]}))
+
+        def ping() -> None:
+            try:
+                while not self._stopped.wait(_PING_INTERVAL) and ws.sock and ws.sock.connected:
+                    ws.send(json.dumps({'op': 'ping'}))
+            except websocket.WebSocketException:
+                # Connection closed, run loop reconnects
+                pass
+
+        threading.Thread(target=ping, daemon=True).start()
+
+    def _safe_write(self, currency_pair: str, rate: float, symbol: str) -> None:
+        try:
+            self._write(currency_pair, rate, symbol)
+        except Exception as e:
+            print("failed writing price of '%s': %s" % (currency_pair, e))
+
+
+def _tickers(data: dict) -> list:
+    # Snapshots carry one ticker, deltas carry updated fields of tickers
+    if data.get('type') == 'delta':
+        return data.get('data', {}).get('update', [])
+    return [data.get('data', {})]
+
+
+def _last_price(ticker: dict) -> Optional[float]:
+    if ticker.get('last_price'):
+        return float(ticker['last_price'])
+    if ticker.get('last_price_e4'):
+        return int(ticker['last_price_e4']) / 10000
+    return None
+
+
+def main() -> None:
+    secrets = get_secret_keys(["BYBIT_IS_TESTNET", "BYBIT_API_KEY", "BYBIT_API_SECRET"])
+    test = secrets["BYBIT_IS_TESTNET"].strip() == 'True'
+    ingestor = PriceIngestor(
+        BybitClient(secrets["BYBIT_API_KEY"], secrets["BYBIT_API_SECRET"], test),
+        os.environ["TARGET_MARKETS"].split('|'),
+        os.environ.get('BYBIT_WS_URL', BYBIT_TESTNET_WS_URL if test else BYBIT_WS_URL),
+        PriceThrottle(
+            float(os.environ.get('PRICE_MIN_CHANGE', 0.0005)),
+            float(os.environ.get('PRICE_MIN_INTERVAL', 5)),
+            float(os.environ.get('PRICE_MAX_INTERVAL', 60))))
+    ingestor.run()
+
+
+if __name__ == '__main__':
+    main()
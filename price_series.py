@@ -0,0 +1,178 @@
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Optional, Sequence, Tuple
+import numpy as np
+import threading
+
+
+class PriceSeries:
+
+    def __init__(self, currency_pair: str, capacity: int = 3 * 24 * 60) -> None:
+        """Recent prices of a currency pair, kept in a ring buffer of numpy arrays
+
+        Args:
+            currency_pair (str): curreny pair (eg: BTC-USD)
+            capacity (int, optional): prices kept, oldest ones are overwritten. Defaults to 3 days of minutes.
+        """
+        self.currency_pair = currency_pair
+        self.capacity = capacity
+        self._timestamps = np.zeros(capacity, dtype=np.int64)
+        self._rates = np.zeros(capacity, dtype=np.float64)
+        self._volumes = np.full(capacity, np.nan, dtype=np.float64)
+        self._next = 0
+        self._size = 0
+        # Unix time at which series was last refreshed from storage, set by its loader
+        self.refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def last_timestamp(self) -> int:
+        """Unix time of newest price, 0 if series is empty"""
+        with self._lock:
+            return int(self._timestamps[self._next - 1]) if self._size else 0
+
+    def extend(
+        self,
+        timestamps: Sequence[int],
+        rates: Sequence[float],
+        volumes: Optional[Sequence[float]] = None) -> int:
+        """Append prices in timestamp order, skipping those not newer than the newest price
+
+        Args:
+            timestamps (Sequence[int]): unix times of prices, ascending
+            rates (Sequence[float]): prices
+            volumes (Optional[Sequence[float]], optional): traded volumes, NaN if unknown.
+
+        Returns:
+            int: number of prices appended
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        rates = np.asarray(rates, dtype=np.float64)
+        volumes = np.full(len(timestamps), np.nan) if volumes is None else np.asarray(volumes, dtype=np.float64)
+
+        with self._lock:
+            if self._size:
+                newer = timestamps > self._timestamps[self._next - 1]
+                timestamps, rates, volumes = timestamps[newer], rates[newer], volumes[newer]
+
+            # Only the newest `capacity` prices can be kept
+            timestamps, rates, volumes = timestamps[-self.capacity:], rates[-self.capacity:], volumes[-self.capacity:]
+            positions = (self._next + np.arange(len(timestamps))) % self.capacity
+            self._timestamps[positions] = timestamps
+            self._rates[positions] = rates
+            self._volumes[positions] = volumes
+            self._next = (self._next + len(timestamps)) % self.capacity
+            self._size = min(self._size + len(timestamps), self.capacity)
+            return len(timestamps)
+
+    def window(self, seconds: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get prices of last seconds before the newest price, oldest first
+
+        Args:
+            seconds (Optional[float], optional): length of window. Defaults to whole series.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: timestamps, rates and volumes
+        """
+        with self._lock:
+            order = (self._next - self._size + np.arange(self._size)) % self.capacity
+            timestamps, rates, volumes = self._timestamps[order], self._rates[order], self._volumes[order]
+
+        if seconds is not None and len(timestamps):
+            start = np.searchsorted(timestamps, timestamps[-1] - seconds, side='left')
+            timestamps, rates, volumes = timestamps[start:], rates[start:], volumes[start:]
+        return timestamps, rates, volumes
+
+    def twap(self, seconds: Optional[float] = None) -> float:
+        """Time weighted average price, each price lasting until the next one
+
+        Args:
+            seconds (Optional[float], optional): length of window. Defaults to whole series.
+
+        Returns:
+            float: average price, NaN if series is empty
+        """
+        timestamps, rates, _ = self.window(seconds)
+        if not len(rates):
+            return float('nan')
+        durations = np.diff(timestamps)
+        if not durations.sum():
+            return float(rates[-1])
+        return float(np.dot(rates[:-1], durations) / durations.sum())
+
+    def vwap(self, seconds: Optional[float] = None) -> float:
+        """Volume weighted average price of prices with known volume
+
+        Args:
+            seconds (Optional[float], optional): length of window. Defaults to whole series.
+
+        Raises:
+            ValueError: if no price of window has a volume
+
+        Returns:
+            float: average price
+        """
+        _, rates, volumes = self.window(seconds)
+        known = ~np.isnan(volumes)
+        if not known.any() or not volumes[known].sum():
+            raise ValueError('no volume recorded for %s' % self.currency_pair)
+        return float(np.dot(rates[known], volumes[known]) / volumes[known].sum())
+
+    def volatility(self, seconds: Optional[float] = None) -> float:
+        """Standard deviation of log returns between consecutive prices
+
+        Args:
+            seconds (Optional[float], optional): length of window. Defaults to whole series.
+
+        Returns:
+            float: volatility per price interval, NaN if there are less than 2 returns
+        """
+        _, rates, _ = self.window(seconds)
+        returns = np.diff(np.log(rates))
+        return float(returns.std(ddof=1)) if len(returns) > 1 else float('nan')
+
+    def rolling_volatility(self, points: int, seconds: Optional[float] = None) -> np.ndarray:
+        """Volatility over each run of `points` consecutive log returns
+
+        Args:
+            points (int): log returns per rolling window
+            seconds (Optional[float], optional): length of window. Defaults to whole series.
+
+        Returns:
+            np.ndarray: volatility ending at each price, empty if there are too few prices
+        """
+        _, rates, _ = self.window(seconds)
+        returns = np.diff(np.log(rates))
+        if len(returns) < max(points, 2):
+            return np.empty(0)
+        return sliding_window_view(returns, points).std(axis=1, ddof=1)
+
+    def max_drawdown(self, seconds: Optional[float] = None) -> float:
+        """Largest fall from a running peak, as ratio of the peak
+
+        Args:
+            seconds (Optional[float], optional): length of window. Defaults to whole series.
+
+        Returns:
+            float: drawdown between 0 and 1, 0 if series is empty
+        """
+        _, rates, _ = self.window(seconds)
+        if not len(rates):
+            return 0.0
+        peaks = np.maximum.accumulate(rates)
+        return float(((peaks - rates) / peaks).max())
+
+    def deviation(self, rate: float, seconds: Optional[float] = None) -> float:
+        """Relative difference of a rate from TWAP, eg: to check slippage of an order
+
+        Args:
+            rate (float): rate to check
+            seconds (Optional[float], optional): length of window. Defaults to whole series.
+
+        Returns:
+            float: (rate - twap) / twap
+        """
+        twap = self.twap(seconds)
+        return (rate - twap) / twap
@@ -1,6 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import secretmanager
+from typing import Dict, List
+import threading
 import utils
 
+_client = None
+_client_lock = threading.Lock()
+
+def get_secret_client() -> secretmanager.SecretManagerServiceClient:
+    """Get secret manager client shared by all secret lookups of this instance.
+
+    Returns:
+        secretmanager.SecretManagerServiceClient: shared client
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = secretmanager.SecretManagerServiceClient()
+    return _client
+
+def set_secret_client(client) -> None:
+    """Replace secret manager client shared by all secret lookups of this instance
+    (eg: with a fake secret provider for benchmarks).
+
+    Args:
+        client (secretmanager.SecretManagerServiceClient): client
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
 def get_secret_key(secret_name: str) -> str:
     """Get secret key from secret manager for given secret name.
 
@@ -11,7 +41,7 @@ def get_secret_key(secret_name: str) -> str:
         raise ValueError('secret name can not be empty.')
 
     # Setup the Secret manager Client
-    client = secretmanager.SecretManagerServiceClient()
+    client = get_secret_client()
     
     # Get project id from enviornment
     project_id = utils.get_project_id()
@@ -20,3 +50,19 @@ def get_secret_key(secret_name: str) -> str:
     request = {"name": f"projects/{project_id}/secrets/{secret_name}/versions/latest"}
     response = client.access_secret_version(request)
     return response.payload.data.decode("UTF-8")
+
+def get_secret_keys(secret_names: List[str]) -> Dict[str, str]:
+    """Get secret keys from secret manager for given secret names concurrently.
+
+    Args:
+        secret_names (List[str]): Names of secrets
+
+    Returns:
+        Dict[str, str]: secret keys by secret name
+    """
+    if not secret_names:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(secret_names)) as executor:
+        values = executor.map(get_secret_key, secret_names)
+        return dict(zip(secret_names, values))
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, TypeVar
+import contextvars
+import queue
+import threading
+
+T = TypeVar('T')
+
+
+def partition_queries(collection_group, partition_count: int) -> list:
+    """Split a collection group into queries over disjoint key ranges, with a firestore
+    partition query. Partitions are roughly equal in size, and there may be fewer of
+    them than asked for if collection group is small.
+
+    Args:
+        collection_group (firestore.CollectionGroup): collection group to split
+        partition_count (int): wanted number of partitions
+
+    Returns:
+        list: queries, together returning every document of collection group once
+    """
+    if partition_count <= 1:
+        return [collection_group]
+    return [partition.query() for partition in collection_group.get_partitions(partition_count)]
+
+
+def scan_partitions(queries: list, process: Callable[[object], T], max_workers: int) -> List[T]:
+    """Process queries concurrently, at most `max_workers` at once
+
+    Args:
+        queries (list): queries (eg: returned by `partition_queries`)
+        process (Callable[[object], T]): function turning a query into a partial result
+        max_workers (int): maximum number of queries processed at once
+
+    Returns:
+        List[T]: partial result of each query, in order of queries
+    """
+    if len(queries) == 1:
+        return [process(queries[0])]
+
+    # Each worker sees the active trace span of the caller
+    with ThreadPoolExecutor(max_workers=max(min(max_workers, len(queries)), 1)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, process, query) for query in queries]
+        return [future.result() for future in futures]
+
+
+def stream_partitions(
+    queries: list,
+    process: Callable[[object], Iterable[T]],
+    max_workers: int,
+    buffer: int = 500) -> Iterator[T]:
+    """Process queries concurrently, at most `max_workers` at once, and stream their items
+    through a bounded queue, so memory use doesn't grow with size of collections
+
+    Args:
+        queries (list): queries (eg: returned by `partition_queries`)
+        process (Callable[[object], Iterable[T]]): function turning a query into items
+        max_workers (int): maximum number of queries processed at once
+        buffer (int, optional): items buffered before workers wait for consumer. Defaults to 500.
+
+    Yields:
+        T: items of all queries, in no particular order
+    """
+    pending = queue.Queue()
+    for query in queries:
+        pending.put(query)
+    items = queue.Queue(maxsize=buffer)
+    done = object()
+
+    # Set when consumer stops (eg: closes generator or fails), so workers waiting on a
+    # full queue give up instead of blocking forever
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work() -> None:
+        try:
+            while not stopped.is_set():
+                try:
+                    query = pending.get_nowait()
+                except queue.Empty:
+                    break
+                for item in process(query):
+                    if not put(item):
+                        return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    workers = max(min(max_workers, len(queries)), 1)
+    for _ in range(workers):
+        # Daemon threads, so a consumer which stops early doesn't block exit
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(work,), daemon=True).start()
+
+    remaining = workers
+    try:
+        while remaining:
+            item = items.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,213 @@
+from dataclasses import asdict, dataclass, field
+from typing import Dict
+
+# Statuses of conversions which are counted in stats
+COUNTED_STATUSES = ('done', 'pending')
+
+# Statuses after which a conversion no longer changes
+SETTLED_STATUSES = ('done', 'error')
+
+
+@dataclass
+class CurrencyTotals:
+    """Conversions of one currency to or from USDS"""
+    count: int = 0
+    amount: float = 0.0
+    usds_amount: float = 0.0
+
+
+@dataclass
+class ConversionStats:
+    """Conversion counts and amounts, with per-currency and per-user breakdowns"""
+    total_users: int = 0
+    from_usds_count: int = 0
+    from_usds_amount: float = 0.0
+    to_usds_count: int = 0
+    to_usds_amount: float = 0.0
+    from_usds_by_currency: Dict[str, CurrencyTotals] = field(default_factory=dict)
+    to_usds_by_currency: Dict[str, CurrencyTotals] = field(default_factory=dict)
+    usds_amount_by_user: Dict[str, float] = field(default_factory=dict)
+    rows_by_user: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, uid: str, row: dict) -> None:
+        """Fold a conversion history row into stats
+
+        Args:
+            uid (str): id of user who made the conversion
+            row (dict): conversion history fields (from_currency, to_currency, amount, rate, status)
+        """
+        self._apply(uid, row, 1)
+
+    def remove(self, uid: str, row: dict) -> None:
+        """Take back a conversion history row previously folded into stats
+
+        Args:
+            uid (str): id of user who made the conversion
+            row (dict): conversion history fields as they were when added
+        """
+        self._apply(uid, row, -1)
+
+    def _apply(self, uid: str, row: dict, sign: int) -> None:
+        rows = self.rows_by_user.get(uid, 0) + sign
+        if rows == 1 and sign > 0:
+            self.total_users += 1
+        elif rows == 0:
+            self.total_users -= 1
+        self.rows_by_user[uid] = rows
+        self.usds_amount_by_user.setdefault(uid, 0.0)
+
+        if row.get('status') not in COUNTED_STATUSES:
+            return
+
+        amount = row['amount']
+        if row['from_currency'] == 'USDS':
+            usds_amount = amount
+            self.from_usds_count += sign
+            self.from_usds_amount += sign * usds_amount
+            totals = self.from_usds_by_currency.setdefault(row.get('to_currency', 'UNKNOWN'), CurrencyTotals())
+        else:
+            usds_amount = amount * row['rate']
+            self.to_usds_count += sign
+            self.to_usds_amount += sign * usds_amount
+            totals = self.to_usds_by_currency.setdefault(row['from_currency'], CurrencyTotals())
+
+        totals.count += sign
+        totals.amount += sign * amount
+        totals.usds_amount += sign * usds_amount
+        self.usds_amount_by_user[uid] += sign * usds_amount
+
+    def merge(self, other: 'ConversionStats') -> None:
+        """Fold stats of other rows (eg: of another partition of history) into stats
+
+        Args:
+            other (ConversionStats): stats of rows not folded into these stats
+        """
+        self.from_usds_count += other.from_usds_count
+        self.from_usds_amount += other.from_usds_amount
+        self.to_usds_count += other.to_usds_count
+        self.to_usds_amount += other.to_usds_amount
+        for mine, theirs in ((self.from_usds_by_currency, other.from_usds_by_currency),
+                             (self.to_usds_by_currency, other.to_usds_by_currency)):
+            for currency, totals in theirs.items():
+                merged = mine.setdefault(currency, CurrencyTotals())
+                merged.count += totals.count
+                merged.amount += totals.amount
+                merged.usds_amount += totals.usds_amount
+        for uid, rows in other.rows_by_user.items():
+            self.rows_by_user[uid] = self.rows_by_user.get(uid, 0) + rows
+            self.usds_amount_by_user[uid] = self.usds_amount_by_user.get(uid, 0.0) + other.usds_amount_by_user.get(uid, 0.0)
+
+        # Rows of a user may be split across both stats
+        self.total_users = sum(1 for rows in self.rows_by_user.values() if rows > 0)
+
+    def to_dict(self) -> dict:
+        """Serialize totals, without per-user breakdown"""
+        data = asdict(self)
+        del data['usds_amount_by_user']
+        del data['rows_by_user']
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ConversionStats':
+        """Deserialize totals written by `to_dict`"""
+        data = dict(data)
+        for key in ('from_usds_by_currency', 'to_usds_by_currency'):
+            data[key] = {currency: CurrencyTotals(**totals) for currency, totals in data.get(key, {}).items()}
+        return cls(**data)
+
+    def user_to_dict(self, uid: str) -> dict:
+        """Serialize totals of a user"""
+        return {'rows': self.rows_by_user.get(uid, 0), 'usds_amount': self.usds_amount_by_user.get(uid, 0.0)}
+
+    def load_user(self, uid: str, data: dict) -> None:
+        """Restore totals of a user written by `user_to_dict`"""
+        self.rows_by_user[uid] = data.get('rows', 0)
+        self.usds_amount_by_user[uid] = data.get('usds_amount', 0.0)
+
+    def print_summary(self) -> None:
+        print('Total number of users who performed conversion: {}'.format(self.total_users))
+        print('[FROM USDS] Total number of conversions: {}'.format(self.from_usds_count))
+        print('[FROM USDS] Total amount of conversions: {} USDS'.format(self.from_usds_amount))
+        print('[TO USDS] Total number of conversions: {}'.format(self.to_usds_count))
+        print('[TO USDS] Total amount of conversions: {} USDS'.format(self.to_usds_amount))
+
+
+@dataclass
+class InterestStats:
+    """Interest payment counts and amounts, with per-user breakdown"""
+    total_users: int = 0
+    total_payments: int = 0
+    total_interest_paid: float = 0.0
+    interest_paid_by_user: Dict[str, float] = field(default_factory=dict)
+    payments_by_user: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, uid: str, row: dict) -> None:
+        """Fold an interest payment history row into stats
+
+        Args:
+            uid (str): id of user to whom interest is paid
+            row (dict): interest payment fields (amount)
+        """
+        self._apply(uid, row, 1)
+
+    def remove(self, uid: str, row: dict) -> None:
+        """Take back an interest payment history row previously folded into stats
+
+        Args:
+            uid (str): id of user to whom interest is paid
+            row (dict): interest payment fields as they were when added
+        """
+        self._apply(uid, row, -1)
+
+    def _apply(self, uid: str, row: dict, sign: int) -> None:
+        payments = self.payments_by_user.get(uid, 0) + sign
+        if payments == 1 and sign > 0:
+            self.total_users += 1
+        elif payments == 0:
+            self.total_users -= 1
+        self.payments_by_user[uid] = payments
+
+        self.total_payments += sign
+        self.total_interest_paid += sign * row['amount']
+        self.interest_paid_by_user[uid] = self.interest_paid_by_user.get(uid, 0.0) + sign * row['amount']
+
+    def merge(self, other: 'InterestStats') -> None:
+        """Fold stats of other rows (eg: of another partition of history) into stats
+
+        Args:
+            other (InterestStats): stats of rows not folded into these stats
+        """
+        self.total_payments += other.total_payments
+        self.total_interest_paid += other.total_interest_paid
+        for uid, payments in other.payments_by_user.items():
+            self.payments_by_user[uid] = self.payments_by_user.get(uid, 0) + payments
+            self.interest_paid_by_user[uid] = (
+                self.interest_paid_by_user.get(uid, 0.0) + other.interest_paid_by_user.get(uid, 0.0))
+
+        # Payments of a user may be split across both stats
+        self.total_users = sum(1 for payments in self.payments_by_user.values() if payments > 0)
+
+    def to_dict(self) -> dict:
+        """Serialize totals, without per-user breakdown"""
+        data = asdict(self)
+        del data['interest_paid_by_user']
+        del data['payments_by_user']
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'InterestStats':
+        """Deserialize totals written by `to_dict`"""
+        return cls(**data)
+
+    def user_to_dict(self, uid: str) -> dict:
+        """Serialize totals of a user"""
+        return {'rows': self.payments_by_user.get(uid, 0), 'amount': self.interest_paid_by_user.get(uid, 0.0)}
+
+    def load_user(self, uid: str, data: dict) -> None:
+        """Restore totals of a user written by `user_to_dict`"""
+        self.payments_by_user[uid] = data.get('rows', 0)
+        self.interest_paid_by_user[uid] = data.get('amount', 0.0)
+
+    def print_summary(self) -> None:
+        print('Total number of users to whom interest is paid: {}'.format(self.total_users))
+        print('Total interest paid out: {} USDS'.format(self.total_interest_paid))
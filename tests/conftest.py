@@ -0,0 +1,14 @@
+import pytest
+
+from benchmark.exchange_simulator import ExchangeSimulator
+from benchmark.fake_firestore import FakeFirestore
+from benchmark.run import load_main
+
+
+@pytest.fixture
+def env():
+    """main with firestore and exchanges replaced by the benchmark stand-ins"""
+    db = FakeFirestore()
+    with ExchangeSimulator(latency=0, jitter=0) as simulator:
+        main = load_main(simulator, db)
+        yield main, db, simulator
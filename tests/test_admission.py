@@ -0,0 +1,66 @@
+import threading
+import time
+
+from admission import AdmissionController, FirestoreSemaphore, LocalSemaphore
+from benchmark.fake_firestore import FakeFirestore
+
+
+def test_waiting_requests_are_admitted_highest_priority_first():
+    semaphore = LocalSemaphore(1)
+    controller = AdmissionController(semaphore, poll_interval=0.01)
+    held = controller.acquire(priority=0, timeout=1)
+    assert held is not None
+
+    admitted = []
+
+    def request(priority: float) -> None:
+        with controller.admit(priority, timeout=5) as ok:
+            assert ok
+            admitted.append(priority)
+
+    threads = []
+    for priority in (1, 50, 5, 100):
+        thread = threading.Thread(target=request, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        # Arrival order is fixed before the held slot is released
+        while controller.waiting < len(threads):
+            time.sleep(0.001)
+
+    controller.release(held)
+    for thread in threads:
+        thread.join()
+
+    assert admitted == [100, 50, 5, 1]
+    assert controller.waiting == 0
+
+
+def test_acquire_times_out_when_no_slot_is_released():
+    controller = AdmissionController(LocalSemaphore(1), poll_interval=0.01)
+    held = controller.acquire(priority=0, timeout=1)
+
+    started = time.monotonic()
+    assert controller.acquire(priority=10, timeout=0.1) is None
+    assert time.monotonic() - started >= 0.1
+    assert controller.waiting == 0
+
+    controller.release(held)
+    with controller.admit(priority=10, timeout=0.1) as ok:
+        assert ok
+
+
+def test_firestore_semaphore_reclaims_expired_slot():
+    db = FakeFirestore(latency=0)
+    crashed = FirestoreSemaphore(db, limit=1, lease=0.05)
+    other = FirestoreSemaphore(db, limit=1, lease=60)
+
+    assert crashed.try_acquire() is not None
+    assert other.try_acquire() is None
+
+    time.sleep(0.1)
+    slot = other.try_acquire()
+    assert slot is not None
+
+    # Release of reclaimed slot by its crashed holder leaves new holder's slot alone
+    other.release(slot)
+    assert len(list(db.collection('order_admission').stream())) == 0
@@ -0,0 +1,91 @@
+import datetime
+import types
+
+import pytest
+
+import instrument_catalog
+from instrument_catalog import InstrumentCatalog, _parse_expiry
+
+DECEMBER = {'name': 'BTCUSDZ26', 'alias': 'BTCUSD1225', 'status': 'Trading', 'base_currency': 'BTC',
+            'quote_currency': 'USD'}
+MARCH = {'name': 'BTCUSDH27', 'alias': 'BTCUSD0326', 'status': 'Trading', 'base_currency': 'BTC',
+         'quote_currency': 'USD'}
+JUNE = {'name': 'BTCUSDM27', 'alias': 'BTCUSD0625', 'status': 'Trading', 'base_currency': 'BTC',
+        'quote_currency': 'USD'}
+PERPETUAL = {'name': 'BTCUSD', 'alias': 'BTCUSD', 'status': 'Trading', 'base_currency': 'BTC',
+             'quote_currency': 'USD'}
+
+MARGIN = 3600
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """utcnow of instrument_catalog, set by tests"""
+    class Clock(datetime.datetime):
+        now = datetime.datetime(2026, 12, 1)
+
+        @classmethod
+        def utcnow(cls):
+            return cls.now
+
+    monkeypatch.setattr(instrument_catalog, 'datetime', types.SimpleNamespace(
+        datetime=Clock, timedelta=datetime.timedelta))
+    return Clock
+
+
+def _catalog(symbols: list, fetches: list = None) -> InstrumentCatalog:
+    def fetch_symbols():
+        if fetches is not None:
+            fetches.append(1)
+        return list(symbols)
+    return InstrumentCatalog(fetch_symbols, ttl=86400, delivery_margin=MARGIN)
+
+
+def test_expiry_is_parsed_across_year_boundary():
+    assert _parse_expiry(DECEMBER) == datetime.datetime(2026, 12, 25, 8)
+    assert _parse_expiry(MARCH) == datetime.datetime(2027, 3, 26, 8)
+    assert _parse_expiry(PERPETUAL) is None
+
+
+def test_delivery_time_is_parsed_like_alias():
+    with_delivery_time = dict(DECEMBER, delivery_time='2026-12-25T08:00:00Z')
+    assert _parse_expiry(with_delivery_time) == _parse_expiry(DECEMBER)
+
+    # Delivery time of exchange wins over the one derived from alias
+    moved = dict(DECEMBER, delivery_time='2026-12-24T08:00:00Z')
+    assert _parse_expiry(moved) == datetime.datetime(2026, 12, 24, 8)
+
+
+def test_front_and_next_contracts_are_ordered_across_year_boundary(clock):
+    resolved = _catalog([MARCH, PERPETUAL, DECEMBER]).resolve(['BTC'])['BTC']
+    assert (resolved.front.name, resolved.next.name) == ('BTCUSDZ26', 'BTCUSDH27')
+
+
+def test_next_contract_is_resolved_from_delivery_margin(clock):
+    expiry = datetime.datetime(2026, 12, 25, 8)
+
+    clock.now = expiry - datetime.timedelta(seconds=MARGIN + 1)
+    assert _catalog([DECEMBER, MARCH]).get_next_symbol_name('BTC') == 'BTCUSDZ26'
+
+    clock.now = expiry - datetime.timedelta(seconds=MARGIN)
+    resolved = _catalog([DECEMBER, MARCH]).resolve(['BTC'])['BTC']
+    assert (resolved.front.name, resolved.next) == ('BTCUSDH27', None)
+
+
+def test_memoized_resolution_is_dropped_at_valid_until(clock):
+    symbols = [DECEMBER, MARCH]
+    fetches = []
+    catalog = _catalog(symbols, fetches)
+    valid_until = datetime.datetime(2026, 12, 25, 8) - datetime.timedelta(seconds=MARGIN)
+
+    resolved = catalog.resolve(['BTC'])
+    symbols.append(JUNE)
+    clock.now = valid_until - datetime.timedelta(seconds=1)
+    assert catalog.resolve(['BTC']) is resolved
+    assert len(fetches) == 1
+
+    # Front contract reached its delivery margin, so catalog is reloaded with newly listed contracts
+    clock.now = valid_until
+    resolved = catalog.resolve(['BTC'])['BTC']
+    assert (resolved.front.name, resolved.next.name) == ('BTCUSDH27', 'BTCUSDM27')
+    assert len(fetches) == 2
@@ -0,0 +1,13 @@
+import db_records
+
+
+def test_purge_with_page_size_above_batch_limit_deletes_every_expired_entry(env):
+    main, db, simulator = env
+    for i in range(db_records.MAX_BATCH_SIZE + 100):
+        db.seed('order_journal/%s' % i, {'created_at': 0})
+    db.seed('order_journal/recent', {'created_at': 2 ** 40})
+
+    stats = db_records.DbRecords().delete_old_order_journal_documents(
+        86400, page_size=2 * db_records.MAX_BATCH_SIZE)
+    assert stats.deleted == db_records.MAX_BATCH_SIZE + 100
+    assert [snapshot.id for snapshot in db.collection('order_journal').stream()] == ['recent']
@@ -0,0 +1,51 @@
+import time
+
+from benchmark.run import _Context
+
+PATH = 'convert_history/user1/history/USDT'
+RESOURCE = 'projects/benchmark/databases/(default)/documents/' + PATH
+FIELDS = {'from_currency': 'USDT', 'to_currency': 'USDS', 'amount': 100.0, 'rate': 1.0, 'status': 'pending'}
+
+
+def _place_order(main, db) -> None:
+    # Ftx leg sizes its order from latest btc price
+    db.seed('price_histories/BTC-USD-latest', {
+        'currency_pair': 'BTC-USD', 'rate': 50000.0, 'market': 'BTC-PERP', 'timestamp': int(time.time())})
+    db.seed(PATH, FIELDS)
+    event = {'value': {'fields': {key: {'stringValue': str(value)} for key, value in FIELDS.items()}}}
+    main.place_order_api(event, _Context(RESOURCE))
+
+
+def _orders(db) -> list:
+    return [snapshot.to_dict() for snapshot in db.collection(PATH + '/order').stream()]
+
+
+def test_both_legs_placed_is_sent(env):
+    main, db, simulator = env
+    _place_order(main, db)
+    assert db.document(PATH).get().to_dict()['status'] == 'sent'
+    assert sorted(order['exchange'] for order in _orders(db) if 'exchange' in order) == ['bybit', 'ftx']
+
+
+def test_ftx_leg_placed_while_bybit_leg_failed_is_left_for_review(env, monkeypatch):
+    main, db, simulator = env
+
+    def place_order(*args, **kwargs):
+        raise Exception('order rejected')
+
+    monkeypatch.setattr(main._get_bybit_client(), 'place_order', place_order)
+    _place_order(main, db)
+    assert db.document(PATH).get().to_dict()['status'] == 'review'
+    assert [order['exchange'] for order in _orders(db) if 'exchange' in order] == ['ftx']
+
+
+def test_no_leg_placed_is_error(env, monkeypatch):
+    main, db, simulator = env
+
+    def place_order(*args, **kwargs):
+        raise Exception('order rejected')
+
+    monkeypatch.setattr(main._get_bybit_client(), 'place_order', place_order)
+    monkeypatch.setattr(main._get_ftx_client(), 'place_order', place_order)
+    _place_order(main, db)
+    assert db.document(PATH).get().to_dict()['status'] == 'error'
@@ -0,0 +1,88 @@
+import db_records
+
+from benchmark.run import _Context
+
+PATH = 'convert_history/user1/history/BTC'
+RESOURCE = 'projects/benchmark/databases/(default)/documents/' + PATH
+FIELDS = {'from_currency': 'BTC', 'to_currency': 'USDS', 'amount': 0.01, 'rate': 50000.0, 'status': 'pending'}
+
+
+def _place_order(main, db) -> None:
+    db.seed(PATH, FIELDS)
+    event = {'value': {'fields': {key: {'stringValue': str(value)} for key, value in FIELDS.items()}}}
+    main.place_order_api(event, _Context(RESOURCE))
+
+
+def _history(db) -> dict:
+    return db.document(PATH).get().to_dict()
+
+
+def test_rate_limited_order_is_queued_then_placed_by_requeue(env):
+    main, db, simulator = env
+    simulator.order_rate_limit = 0
+    _place_order(main, db)
+    assert _history(db)['status'] == 'queued'
+    assert _history(db)['queued_legs'] == ['bybit']
+
+    simulator.order_rate_limit = None
+    main.requeue_queued_orders({}, _Context())
+    history = _history(db)
+    assert history['status'] == 'sent'
+    assert len(simulator._orders_by_link_id) == 1
+
+
+def test_queued_order_is_claimed_once(env):
+    main, db, simulator = env
+    simulator.order_rate_limit = 0
+    _place_order(main, db)
+
+    snapshot, = db_records.DbRecords().queued_convert_histories(claim_lease=600)
+    assert db_records.DbRecords(RESOURCE).claim_queued_order(snapshot.update_time)
+    assert _history(db)['status'] == 'claimed'
+
+    # Claimed by another run, and its claim hasn't expired
+    assert not db_records.DbRecords(RESOURCE).claim_queued_order(snapshot.update_time)
+    assert db_records.DbRecords().queued_convert_histories(claim_lease=600) == []
+
+
+def test_expired_claim_is_reclaimed_without_placing_order_again(env):
+    main, db, simulator = env
+    simulator.order_rate_limit = 0
+    _place_order(main, db)
+
+    # A requeue run claimed the conversion and placed its bybit order, then crashed
+    snapshot, = db_records.DbRecords().queued_convert_histories(claim_lease=600)
+    assert db_records.DbRecords(RESOURCE).claim_queued_order(snapshot.update_time)
+    db.document(PATH).update({'claimed_at': 0})
+    simulator.order_rate_limit = None
+    symbol = main._get_bybit_client().get_next_symbol_name()
+    db_records.DbRecords(RESOURCE).journal_order_symbol('bybit', symbol)
+    order = main._get_bybit_client().place_order(
+        symbol, 'Sell', 500, order_link_id=getattr(main, '__order_link_id')(RESOURCE, 'bybit'))
+
+    main.requeue_queued_orders({}, _Context())
+    history = _history(db)
+    assert history['status'] == 'sent'
+    assert len(simulator._orders_by_link_id) == 1
+    recorded = [snapshot.to_dict() for snapshot in db.collection(PATH + '/order').stream()]
+    assert order['order_id'] in str(recorded)
+
+
+def test_failed_lookup_of_replayed_order_leaves_conversion_for_review(env, monkeypatch):
+    main, db, simulator = env
+    simulator.order_rate_limit = 0
+    _place_order(main, db)
+
+    # A requeue run claimed the conversion, then crashed
+    snapshot, = db_records.DbRecords().queued_convert_histories(claim_lease=600)
+    assert db_records.DbRecords(RESOURCE).claim_queued_order(snapshot.update_time)
+    db.document(PATH).update({'claimed_at': 0})
+    simulator.order_rate_limit = None
+
+    def find_order(symbol, order_link_id):
+        raise Exception('exchange unavailable')
+
+    monkeypatch.setattr(main._get_bybit_client(), 'find_order', find_order)
+    main.requeue_queued_orders({}, _Context())
+    assert _history(db)['status'] == 'review'
+    assert len(simulator._orders_by_link_id) == 0
@@ -0,0 +1,33 @@
+import threading
+import time
+
+import pytest
+
+from sharded_scan import stream_partitions
+
+
+def test_items_of_all_queries_are_streamed():
+    items = stream_partitions([range(0, 100), range(100, 250), range(250, 300)], iter, 2, buffer=10)
+    assert sorted(items) == list(range(300))
+
+
+def test_workers_stop_when_consumer_stops_early():
+    threads = threading.active_count()
+    items = stream_partitions([range(10000) for _ in range(4)], iter, 4, buffer=5)
+    assert [next(items) for _ in range(3)]
+    items.close()
+
+    deadline = time.monotonic() + 5
+    while threading.active_count() > threads and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert threading.active_count() == threads
+
+
+def test_error_of_a_query_is_raised_to_consumer():
+    def process(query):
+        if query == 'bad':
+            raise ValueError('bad query')
+        return range(10000)
+
+    with pytest.raises(ValueError):
+        list(stream_partitions(['good', 'bad'], process, 2, buffer=5))
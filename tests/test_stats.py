@@ -0,0 +1,46 @@
+import pytest
+
+import db_records
+from benchmark.fake_firestore import FakeFirestore
+
+RESOURCE = 'projects/benchmark/databases/(default)/documents/'
+
+
+@pytest.fixture
+def db():
+    db = FakeFirestore()
+    db_records.set_firestore_client(db)
+    return db
+
+
+def _convert(db, path: str, status: str) -> None:
+    db.seed(path, {'from_currency': 'BTC', 'to_currency': 'USDS', 'amount': 1.0, 'rate': 100.0, 'status': 'pending'})
+    db_records.DbRecords(RESOURCE + path).update_convert_history_document(status)
+
+
+def test_status_writes_of_this_repository_are_folded(db):
+    _convert(db, 'convert_history/user1/history/a', 'sent')
+    _convert(db, 'convert_history/user2/history/b', 'sent')
+    assert db_records.DbRecords().materialize_conversions_stats().to_usds_count == 0
+
+    records = db_records.DbRecords(RESOURCE + 'convert_history/user1/history/a')
+    records.queue_convert_history_document(1, ('bybit',), 'rate limited')
+    records.update_convert_history_document('pending')
+    stats = db_records.DbRecords().materialize_conversions_stats()
+    assert stats.to_usds_count == 1
+    assert stats.to_usds_amount == 100.0
+
+
+def test_status_change_without_checkpoint_field_is_folded(db):
+    _convert(db, 'convert_history/user1/history/a', 'sent')
+    _convert(db, 'convert_history/user1/history/b', 'error')
+    db_records.DbRecords().materialize_conversions_stats()
+
+    # Like conversion_batch, which only sets status and datetime
+    db.document('convert_history/user1/history/a').update({'status': 'done', 'datetime': '2021-01-01 00:00:00'})
+    stats = db_records.DbRecords().materialize_conversions_stats()
+    assert stats.to_usds_count == 1
+    assert stats.total_users == 1
+
+    rows = list(db.collection('stats/conversions/rows').where('unsettled', '==', True).stream())
+    assert rows == []
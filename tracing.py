@@ -0,0 +1,172 @@
+from typing import Callable, Optional
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# Ratio of traces recorded, overridable per entry point
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+
+# Set to 'otel' to also export spans through opentelemetry's global tracer provider
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'log')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, attributes: dict) -> None:
+        """A timed operation of a trace
+
+        Args:
+            name (str): name of operation (eg: bybit.place_order)
+            trace_id (str): id of trace, shared by all spans of an invocation
+            parent_id (Optional[str]): id of enclosing span
+            sampled (bool): whether span is recorded
+            attributes (dict): extra fields logged with span
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.payload_bytes = 0
+        self.retries = 0
+        self.error = None
+        self._started = time.time()
+        self._otel_span = None
+
+    def set(self, **attributes) -> None:
+        """Add extra fields logged with span"""
+        self.attributes.update(attributes)
+
+    def to_dict(self, duration_ms: float) -> dict:
+        record = {
+            'severity': 'ERROR' if self.error else 'INFO',
+            'message': 'span {} {:.1f}ms'.format(self.name, duration_ms),
+            'span': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'duration_ms': round(duration_ms, 2),
+            'payload_bytes': self.payload_bytes,
+            'retries': self.retries,
+        }
+        if self.error:
+            record['error'] = self.error
+        record.update(self.attributes)
+        return record
+
+
+@contextlib.contextmanager
+def span(name: str, root: bool = False, sample_rate: float = None, **attributes):
+    """Time a block as a span of current trace and log it as a json line
+
+    Args:
+        name (str): name of operation
+        root (bool, optional): start a new trace even if a span is active. Defaults to False.
+        sample_rate (float, optional): ratio of new traces recorded. Defaults to TRACE_SAMPLE_RATE.
+
+    Yields:
+        Span: span, whose payload size, retries and attributes can be updated
+    """
+    parent = None if root else _current_span.get()
+    if parent is None:
+        rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+        current = Span(name, uuid.uuid4().hex, None, random.random() < rate, attributes)
+    else:
+        current = Span(name, parent.trace_id, parent.span_id, parent.sampled, attributes)
+
+    if current.sampled and otel_trace is not None and TRACE_EXPORTER == 'otel':
+        context = otel_trace.set_span_in_context(parent._otel_span) if parent and parent._otel_span else None
+        current._otel_span = otel_trace.get_tracer(__name__).start_span(name, context=context)
+
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = str(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        if current.sampled:
+            _emit(current, (time.time() - current._started) * 1000)
+
+
+def current_span() -> Optional[Span]:
+    """Get active span, if any"""
+    return _current_span.get()
+
+
+def record_retry() -> None:
+    """Count a retry in active span"""
+    current = _current_span.get()
+    if current is not None:
+        current.retries += 1
+
+
+def record_payload(size: int) -> None:
+    """Add bytes sent or received to active span"""
+    current = _current_span.get()
+    if current is not None and size:
+        current.payload_bytes += size
+
+
+def traced(name: str = None):
+    """Decorator running a function within a span
+
+    Args:
+        name (str, optional): name of span. Defaults to qualified name of function.
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def entry_point(sample_rate: float = None):
+    """Decorator starting a new trace for each call of a cloud function
+
+    Args:
+        sample_rate (float, optional): ratio of calls traced. Defaults to TRACE_SAMPLE_RATE.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(event, context):
+            with span(func.__name__, root=True, sample_rate=sample_rate,
+                      event_id=getattr(context, 'event_id', None)):
+                return func(event, context)
+        return wrapper
+    return decorator
+
+
+def _emit(current: Span, duration_ms: float) -> None:
+    # One json object per line is parsed by cloud logging as a structured entry. Spans
+    # go to stderr, so they don't mix with output of the function (eg: balance export).
+    sys.stderr.write(json.dumps(current.to_dict(duration_ms), default=str) + '\n')
+
+    if current._otel_span is not None:
+        current._otel_span.set_attribute('payload_bytes', current.payload_bytes)
+        current._otel_span.set_attribute('retries', current.retries)
+        for key, value in current.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                current._otel_span.set_attribute(key, value)
+        if current.error:
+            current._otel_span.set_attribute('error', current.error)
+        current._otel_span.end()
@@ -0,0 +1,250 @@
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
+from tracing import record_payload, record_retry, span
+from typing import Callable, Dict, Optional
+import random
+import requests
+import threading
+import time
+
+# Http status codes on which an idempotent call is retried
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimitError(Exception):
+    """Raised when exchange rejects a call because rate limit is exceeded"""
+
+    def __init__(self, message: str, retry_after: float = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        """Constructor
+
+        Args:
+            rate (float): tokens added per second
+            capacity (int): maximum number of tokens, i.e. allowed burst
+        """
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, waiting until one is available
+
+        Returns:
+            float: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = max(self._paused_until - now, (1 - self._tokens) / self._rate)
+            time.sleep(delay)
+            waited += delay
+
+    def update(self, remaining: Optional[int] = None, reset_at: Optional[float] = None) -> None:
+        """Follow limit reported by exchange
+
+        Args:
+            remaining (Optional[int], optional): calls left in current window
+            reset_at (Optional[float], optional): unix time at which window resets
+        """
+        with self._lock:
+            if remaining is not None:
+                self._tokens = min(self._tokens, float(remaining))
+            if remaining is not None and remaining <= 0 and reset_at:
+                self.pause(reset_at - time.time())
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no token for given seconds"""
+        if seconds > 0:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class Transport:
+
+    def __init__(
+        self,
+        rate: float = 10,
+        capacity: int = 20,
+        max_retries: int = 3,
+        backoff: float = 0.2,
+        pool_size: int = 10) -> None:
+        """Constructor
+
+        Args:
+            rate (float, optional): calls per second allowed by exchange. Defaults to 10.
+            capacity (int, optional): allowed burst of calls. Defaults to 20.
+            max_retries (int, optional): retries of a failed idempotent call. Defaults to 3.
+            backoff (float, optional): base delay in seconds of exponential backoff. Defaults to 0.2.
+            pool_size (int, optional): keep-alive connections kept per host. Defaults to 10.
+        """
+        self.limiter = TokenBucket(rate, capacity)
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.mount(self.session)
+        self._in_flight: Dict[object, Future] = {}
+        self._in_flight_lock = threading.Lock()
+
+    def mount(self, session: requests.Session) -> None:
+        """Make a session use the keep-alive connection pool of this transport
+
+        Args:
+            session (requests.Session): session (eg: of a third party client)
+        """
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+
+    def call(self, func: Callable, idempotent: bool = False, key: object = None):
+        """Call exchange within rate limit
+
+        Args:
+            func (Callable): function making the call, without arguments
+            idempotent (bool, optional): retry transient failures with jittered backoff. Defaults to False.
+            key (object, optional): identical calls in flight with same key share one call.
+
+        Returns:
+            Any: result of func
+        """
+        if key is None:
+            return self._call(func, idempotent)
+
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self._call(func, idempotent))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send http request through pooled session. GET requests are retried and
+        identical in-flight GET requests are coalesced.
+
+        Args:
+            method (str): http method
+            url (str): url
+
+        Returns:
+            requests.Response: response
+        """
+        def send() -> requests.Response:
+            response = self.session.request(method, url, **kwargs)
+            record_payload(len(response.content))
+            self.update_limits(response.headers)
+            if response.status_code in RETRYABLE_STATUS:
+                response.raise_for_status()
+            return response
+
+        idempotent = method.upper() == 'GET'
+        key = (url, repr(sorted((kwargs.get('params') or {}).items()))) if idempotent else None
+        with span('http.request', method=method.upper(), url=url):
+            return self.call(send, idempotent, key)
+
+    def update_limits(self, headers) -> None:
+        """Follow rate limit headers of a response
+
+        Args:
+            headers (Mapping): response headers
+        """
+        if not headers:
+            return
+
+        remaining = headers.get('X-Bapi-Limit-Status') or headers.get('X-RateLimit-Remaining')
+        reset_at = headers.get('X-Bapi-Limit-Reset-Timestamp')
+        retry_after = headers.get('Retry-After')
+        self.limiter.update(
+            int(remaining) if remaining is not None else None,
+            int(reset_at) / 1000 if reset_at is not None else None)
+        if retry_after is not None:
+            try:
+                self.limiter.pause(float(retry_after))
+            except ValueError:
+                pass
+
+    def _call(self, func: Callable, idempotent: bool):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                return func()
+            except Exception as e:
+                if isinstance(e, RateLimitError) and e.retry_after:
+                    self.limiter.pause(e.retry_after)
+                if not idempotent or attempt >= self._max_retries or not _is_retryable(e):
+                    raise
+                attempt += 1
+                record_retry()
+                # Full jitter, so retries of concurrent calls don't hit exchange together
+                time.sleep(random.uniform(0, self._backoff * 2 ** attempt))
+
+
+def is_rate_limited(e: Exception) -> bool:
+    """Check whether a call failed because rate limit of exchange is exceeded, so it
+    was rejected without effect and can be made again later
+
+    Args:
+        e (Exception): error raised by a call
+
+    Returns:
+        bool: True if call was throttled
+    """
+    if isinstance(e, RateLimitError):
+        return True
+    status_code = getattr(e, 'status_code', None)
+    if status_code is None and getattr(e, 'response', None) is not None:
+        status_code = getattr(e.response, 'status_code', None)
+    return status_code == 429
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, (RateLimitError, requests.ConnectionError, requests.Timeout)):
+        return True
+    status_code = getattr(e, 'status_code', None)
+    if status_code is None and getattr(e, 'response', None) is not None:
+        status_code = getattr(e.response, 'status_code', None)
+    return status_code in RETRYABLE_STATUS
+
+
+_transports: Dict[str, Transport] = {}
+_transports_lock = threading.Lock()
+
+def get_transport(name: str, **kwargs) -> Transport:
+    """Get transport shared by all clients of an exchange in this instance
+
+    Args:
+        name (str): name of exchange (eg: bybit, ftx)
+        kwargs: arguments of `Transport` used when it is created
+
+    Returns:
+        Transport: shared transport
+    """
+    with _transports_lock:
+        if name not in _transports:
+            _transports[name] = Transport(**kwargs)
+        return _transports[name]
@@ -1,6 +1,8 @@
+import functools
 import os
 import json
 
+@functools.lru_cache(maxsize=None)
 def get_project_id() -> str:
     """Get google cloud project id from deployment site or locally
 